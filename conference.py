@@ -13,23 +13,38 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+from datetime import date
 from datetime import datetime
+from datetime import timedelta
+import hashlib
+import heapq
+import json
+import operator
+import random
+import time
+import uuid
+import zlib
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
+import models
 from models import ConflictException
+from models import TooManyRequestsException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import ConferenceFeed
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
@@ -37,6 +52,26 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceFacetShard
+from models import ConferenceFacetsForm
+from models import FacetCountForm
+from models import ExportJob
+from models import ExportChunk
+from models import GroupReservation
+from models import GroupRegistrationForm
+from models import AttendeeRegistrationForm
+from models import AttendeeRegistrationForms
+from models import RegistrationStatus
+from models import WaitlistShard
+from models import SeatShard
+from models import SeatHold
+from models import SeatHoldForm
+from models import MapperJob
+from models import MapperShard
+from models import MapperCounter
+from models import ChangeLogEntry
+from models import ChangeForm
+from models import ChangeForms
 from models import TeeShirtSize
 
 # ============================================
@@ -48,10 +83,20 @@ from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SessionTypes
+from models import SessionNeighbours
+from models import SessionCooccurrence
+from models import RecommendationState
+from models import SessionHourBucket
+from models import FeaturedSpeakers
+from models import UserIdentity
+from models import CalendarToken
+from models import FeaturedSpeakerForm
+from models import FeaturedSpeakerForms
 
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerPageForm
 
 # END OF MY IMPORT ADDITIONS =================
 # ============================================
@@ -60,14 +105,109 @@ from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import PROFILE_WRITE_BEHIND
+from settings import PROFILE_WRITE_BEHIND_DELAY
+from settings import COALESCE_SETTINGS
+from settings import RATE_LIMITS
+from settings import SESSION_LEGACY_READS
+from settings import WARMUP_ENABLED
 
 from utils import getUserId
+from utils import getCoalesced
+from utils import setCoalesced
+from utils import takeToken
+from utils import TaskBuffer
+from utils import LocalCache
+from utils import claimUserId
+from utils import MEMCACHE_CAS_RETRIES
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+MEMCACHE_CALENDAR_KEY = "CALENDAR_%04d_%02d"
+CALENDAR_CACHE_TIME = 60 * 60 * 24     # seconds
+MEMCACHE_CALENDAR_WRITTEN_KEY = "CALENDAR_WRITTEN_%04d_%02d"
+CALENDAR_SETTLE_TIME = 60     # seconds a month's buckets are only cached briefly after a write to it
+CALENDAR_MAX_MONTHS = 24
+CALENDAR_UPCOMING_DAYS = 30
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACET_SHARDS = 10
+MEMCACHE_PROFILE_CHANGES_KEY = "PROFILE_CHANGES_%s"
+MEMCACHE_COALESCE_KEY = "COALESCE_%s_%s"
+MEMCACHE_RATE_LIMIT_KEY = "RATE_LIMIT_%s_%s"
+MEMCACHE_FEED_KEY = "FEED_%s"
+MEMCACHE_QUERY_KEY = "CONFERENCE_QUERY_%s"
+MEMCACHE_QUERY_GENERATION_KEY = "CONFERENCE_QUERY_GENERATION"
+QUERY_CACHE_TIME = 60     # seconds; bounds how stale seatsAvailable can be in cached results
+FEED_REFRESH_BATCH = 100
+FEED_SEATS_REFRESH_SECONDS = 60     # attendees' feeds are refreshed at most once per this after seats change
+MEMCACHE_SPEAKER_PAGE_KEY = "SPEAKER_DIRECTORY_%d"
+MEMCACHE_SPEAKER_PAGES_KEY = "SPEAKER_DIRECTORY_PAGES"
+SPEAKER_PAGE_SIZE = 50
+SPEAKER_DIRECTORY_CACHE_TIME = 60 * 60     # seconds
+DELETE_BATCH_SIZE = 500
+DELETE_TASK_SECONDS = 30
+RELEASE_ATTENDEES_BATCH = 100
+CHANGES_BATCH_SIZE = 100
+CHANGELOG_RETENTION_DAYS = 7
+CHANGES_SETTLE_SECONDS = 60     # longest a transaction can take to commit its log entry
+MEMCACHE_ICAL_VERSION_KEY = "ICAL_VERSION_%s"
+ICAL_BATCH_SIZE = 100
+SESSION_INDEX_SHARDS = 4
+SESSION_INDEX_MAX_HOURS = 24
+SESSION_INDEX_RETENTION_DAYS = 2
+MEMCACHE_FEATURED_KEY = "FEATURED_SPEAKERS_%s"
+FEATURED_SPEAKERS_K = 5
+SPEAKER_CACHE = LocalCache('Speaker', size=2000, ttl=600)
+CONFERENCE_CACHE = LocalCache('Conference', size=1000, ttl=600)
+LOCAL_CACHES = {Speaker: SPEAKER_CACHE, Conference: CONFERENCE_CACHE}
+WARMUP_SECONDS = 5
+WARMUP_CONFERENCES = 10
+MAPPER_JOBS = {
+    # name: (kind mapped over, map function, finish function or None)
+    'featured_speakers': ('Conference', '_mapFeaturedSpeakers', None),
+    'seat_counts': ('Profile', '_mapSeatCounts', '_reconcileSeatCounts'),
+    'profile_references': ('Profile', '_mapProfileReferences', None),
+    'session_index': ('Session', '_mapSessionIndex', None),
+    'user_identities': ('Profile', '_mapUserIdentities', None),
+    'speaker_references': ('Speaker', '_mapSpeakerReferences', None),
+    'speaker_stats': ('Session', '_mapSpeakerStats', None),
+}
+MAPPER_SHARDS = 8
+MAPPER_OVERSAMPLING = 32     # scatter keys sampled per shard to pick the key ranges
+MAPPER_BATCH_SIZE = 100
+MAPPER_TASK_SECONDS = 30
+MAPPER_TASK_COUNTERS = 400     # a task checkpoints early once it changed this many counters
+SEAT_RECONCILE_BATCH = 50
+SEAT_RECONCILE_MAX_FINDINGS = 500
+SESSION_MIGRATION_BATCH = 200
+PROFILE_MIGRATION_BATCH = 200
+RECOMMENDATION_PARTITIONS = 16
+RECOMMENDATION_NEIGHBOURS = 20
+RECOMMENDATION_CANDIDATES = 100     # co-occurring sessions kept per session while counting
+RECOMMENDATION_SPEAKER_WEIGHT = 2.0
+RECOMMENDATION_TYPE_WEIGHT = 0.5
+RECOMMENDATION_BATCH_SIZE = 200
+RECOMMENDATION_TASK_SECONDS = 30
+EXPORT_BATCH_SIZE = 200
+EXPORT_EXCLUDED = {
+    # kind: properties left out of the export; the calendar token is the secret of a wishlist feed
+    'Profile': ['calendarToken', 'editTimes'],
+}
+GROUP_REGISTRATION_MAX = 100
+GROUP_REGISTRATION_BATCH = 10
+GROUP_REGISTRATION_SETTLE_SECONDS = 2 * 60     # past the request deadline, when the seats of a dead request go back
+WAITLIST_SHARDS = 5
+SEAT_SHARDS = 10
+SEAT_SHARD_IDLE_SECONDS = 24 * 60 * 60     # seats of a shard not written for this long go back to the conference
+SEAT_HOLD_SECONDS = 10 * 60
+SEAT_HOLD_SWEEP_BATCH = 100
+SEAT_HOLD_SWEEP_SECONDS = 30
+EXPORT_TASK_SECONDS = 30
+EXPORT_DOWNLOAD_CHUNKS = 50     # chunks per download part
+EXPORT_RETENTION_DAYS = 7
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -86,6 +226,15 @@ OPERATORS = {
             'NE':   '!='
             }
 
+FACET_OPERATORS = {
+            '=':    operator.eq,
+            '>':    operator.gt,
+            '>=':   operator.ge,
+            '<':    operator.lt,
+            '<=':   operator.le,
+            '!=':   operator.ne
+            }
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -103,6 +252,37 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_GET_REQUEST_WITH_DATE = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    startDate=messages.StringField(1),
+    endDate=messages.StringField(2),
+)
+
+CONF_GET_UPCOMING_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    days=messages.IntegerField(1),
+)
+
+SESSION_GET_UPCOMING_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    hours=messages.IntegerField(1),
+)
+
+CONF_GROUP_REGISTRATION_REQUEST = endpoints.ResourceContainer(
+    GroupRegistrationForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+CHANGES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    cursor=messages.StringField(1),
+)
+
+SEAT_HOLD_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeHoldKey=messages.StringField(1),
+)
+
 SESSION_GET_CONF_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1)
@@ -116,6 +296,11 @@ SESSION_GET_SPEAKER_REQUEST = endpoints.ResourceContainer(
     websafeSpeakerKey=messages.StringField(1)
 )
 
+SPEAKER_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    page=messages.IntegerField(1)
+)
+
 SESSION_POST_CONF_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1)
@@ -137,6 +322,16 @@ SESSION_POST_WISHLIST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1)
 )
 
+SESSION_GET_RECOMMENDED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1)
+)
+
+SESSION_DELETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1)
+)
+
 SESSION_GET_CONF_REQUEST_WITH_DATE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -179,8 +374,9 @@ class ConferenceApi(remote.Service):
     # MY HELPER FUNCTION ADDITIONS ===============
 
     @staticmethod
-    def _getKeyAndEntityFromWebsafeKeyOfType(websafeKey, entityKind):
-        """Gets a Key and entity from a given websafeKey string. This checks that the key is both valid, contains an entity and is of type entityKind."""
+    def _getKeyAndEntityFromWebsafeKeyOfType(websafeKey, entityKind, cached=False):
+        """Gets a Key and entity from a given websafeKey string. This checks that the key is both valid, contains an entity and is of type entityKind.
+        With cached, Speakers and Conferences come from the in-process cache; only use that copy for reading, as its seat counts may lag."""
 
         # get the Key
         try:
@@ -189,7 +385,10 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException("Invalid key: %s" % websafeKey)
 
         # get the entity
-        entity = key.get()
+        if cached and entityKind in LOCAL_CACHES:
+            entity = LOCAL_CACHES[entityKind].get(websafeKey, lambda websafeKey: key.get())
+        else:
+            entity = key.get()
         if not entity:
             raise endpoints.NotFoundException('No entity found with key: %s' % websafeKey)
 
@@ -211,6 +410,24 @@ class ConferenceApi(remote.Service):
 
         return key
 
+    @staticmethod
+    def _getWebsafeKeys(keys):
+        """Gets websafeKey strings for a list of Keys, for returning them through the API."""
+        return [key.urlsafe() for key in keys]
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putWithTasks(entities, tasks, operation=None):
+        """Put entities and enqueue the buffered tasks in the same transaction, overlapping the two RPCs.
+        If operation is given, the change of every entity is also logged in the transaction."""
+        rpc = tasks.flush_async(transactional=True)
+        ndb.put_multi(entities)
+        if operation:
+            for entity in entities:
+                ConferenceApi._logChange(entity.key, operation)
+        if rpc:
+            rpc.get_result()
+
     @staticmethod
     def _getUserId():
         """Return user id of current logged in user. Raise UnauthorizedException if user is not logged in.
@@ -220,12 +437,30 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         return getUserId(user)
 
+    def _getCoalesced(self, endpoint, key, formClass, compute):
+        """Return the form compute() builds for endpoint, coalescing concurrent recomputations
+        of the same key through memcache as configured in COALESCE_SETTINGS."""
+        data = getCoalesced(MEMCACHE_COALESCE_KEY % (endpoint, key),
+            lambda: protojson.encode_message(compute()),
+            **COALESCE_SETTINGS[endpoint])
+        return protojson.decode_message(formClass, data)
+
+    def _checkRateLimit(self, endpoint):
+        """Raise TooManyRequestsException if the caller has used up its RATE_LIMITS bucket for endpoint.
+        Anonymous callers are limited by remote address."""
+        user = endpoints.get_current_user()
+        caller = getUserId(user) if user else self.request_state.remote_address
+        capacity, rate = RATE_LIMITS[endpoint]
+        if not takeToken(MEMCACHE_RATE_LIMIT_KEY % (endpoint, caller), capacity, rate):
+            raise TooManyRequestsException('Too many requests, please slow down.')
+
     # END OF MY HELPER FUNCTION ADDITIONS ========
     # ============================================
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    @staticmethod
+    def _copyConferenceToForm(conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
         for field in cf.all_fields():
@@ -242,6 +477,14 @@ class ConferenceApi(remote.Service):
         cf.check_initialized()
         return cf
 
+    def _copyConferencesToForms(self, confs):
+        """Return ConferenceForms for the given Conferences, fetching organiser names in one batch."""
+        profiles = ndb.get_multi([ndb.Key(Profile, conf.organizerUserId) for conf in confs])
+        names = dict((prof.key.id(), prof.displayName) for prof in profiles if prof)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId)) for conf in confs]
+        )
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -286,15 +529,31 @@ class ConferenceApi(remote.Service):
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
+        conf = Conference(**data)
+        tasks = TaskBuffer()
+        tasks.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
         )
+
+        # the tasks are enqueued with the conference write, so a rollback leaves none behind
+        @ndb.transactional(xg=True)
+        def txn():
+            rpc = tasks.flush_async(transactional=True)
+            conf.put()
+            ConferenceApi._logChange(c_key, 'create')
+            ConferenceApi._updateFacetCounts([], ConferenceApi._facetCells(conf))
+            ConferenceApi._changeFeed(user_id, 'created', ConferenceApi._renderFeedEntries([conf]))
+            if rpc:
+                rpc.get_result()
+        txn()
+
+        ConferenceApi._updateCalendarIndex(c_key.urlsafe(), None, data['startDate'])
+        ConferenceApi._bumpQueryGeneration()
         return request
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -315,6 +574,9 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        oldStartDate = conf.startDate
+        oldFacetCells = ConferenceApi._facetCells(conf)
+        oldMaxAttendees = conf.maxAttendees or 0
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
@@ -329,9 +591,48 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # seats taken stay taken when the owner changes the number of attendees
+        if request.seatsAvailable is None:
+            delta = (conf.maxAttendees or 0) - oldMaxAttendees
+            conf.seatsAvailable = conf.seatsAvailable or 0
+            if conf.seatsAvailable + delta < 0:
+                raise endpoints.BadRequestException(
+                    "%d seats are already taken; maxAttendees cannot be lower." % (
+                        oldMaxAttendees - conf.seatsAvailable))
+            if ConferenceApi._unparkedSeats(conf) + delta < 0:
+                # the seats parked in seat shards are still free; take them back
+                shards = [shard for shard in ndb.get_multi(ConferenceApi._seatShardKeys(request.websafeConferenceKey))
+                          if shard and shard.seats]
+                for shard in shards:
+                    conf.seatsParked -= shard.seats
+                    shard.seats = 0
+                ndb.put_multi(shards)
+            conf.seatsAvailable += delta
         conf.put()
+        ConferenceApi._logChange(conf.key, 'update')
+        ConferenceApi._updateFacetCounts(oldFacetCells, ConferenceApi._facetCells(conf))
+
+        # move the conference between calendar buckets & drop its cached form once the write is committed
+        ndb.get_context().call_on_commit(lambda: ConferenceApi._updateCalendarIndex(
+            request.websafeConferenceKey, oldStartDate, conf.startDate))
+        ndb.get_context().call_on_commit(lambda: memcache.delete(
+            MEMCACHE_COALESCE_KEY % ('getConference', request.websafeConferenceKey)))
+        ndb.get_context().call_on_commit(lambda: CONFERENCE_CACHE.invalidate(request.websafeConferenceKey))
+        ndb.get_context().call_on_commit(lambda: ConferenceApi._bumpCalendarVersion(
+            'conference_%s' % request.websafeConferenceKey))
+        ndb.get_context().call_on_commit(ConferenceApi._bumpQueryGeneration)
         prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+        # the organiser's feed is in this entity group; attendees' feeds are refreshed by a task
+        ConferenceApi._changeFeed(user_id, 'created', [(cf.websafeKey, protojson.encode_message(cf))])
+        tasks = TaskBuffer()
+        tasks.add(params={'websafeConferenceKey': request.websafeConferenceKey},
+            url='/tasks/refresh_feeds'
+        )
+        tasks.flush(transactional=True)
+        return cf
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -354,14 +655,17 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        def compute():
+            # get Conference object from request; bail if not found
+            conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            prof = conf.key.parent().get()
+            # return ConferenceForm
+            return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+        return self._getCoalesced('getConference', request.websafeConferenceKey, ConferenceForm, compute)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -375,13 +679,8 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        # return set of ConferenceForm objects per Conference from the user's feed
+        return ConferenceApi._getFeedForms(user_id, 'created')
 
     def _getQuery(self, request):
         """Return formatted query from the submitted filters."""
@@ -396,13 +695,42 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
+            filtr["value"] = self._filterValue(filtr)
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
 
 
+    @staticmethod
+    def _filterValue(filtr):
+        """Return the value of a formatted filter coerced to the type of its field."""
+        if filtr["field"] in ["month", "maxAttendees"]:
+            try:
+                return int(filtr["value"])
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException("Filter on %s needs an integer value." % filtr["field"])
+        return filtr["value"]
+
+    def _canonicalQuery(self, filters):
+        """Return a digest identifying the query of the submitted filters regardless of their order."""
+        inequality_filter, filters = self._formatFilters(filters)
+        canonical = sorted((f["field"], f["operator"], self._filterValue(f)) for f in filters)
+        return hashlib.md5(json.dumps(canonical)).hexdigest()
+
+    @staticmethod
+    def _bumpQueryGeneration():
+        """Invalidate every cached queryConferences result by moving to a new generation."""
+        memcache.incr(MEMCACHE_QUERY_GENERATION_KEY)
+
+    @staticmethod
+    def _queryGeneration(cachedGeneration):
+        """Return the current query generation given the cached one, starting a new one if it was evicted.
+        New generations start at the current time in milliseconds so they never reuse an old one."""
+        if cachedGeneration is not None:
+            return cachedGeneration
+        memcache.add(MEMCACHE_QUERY_GENERATION_KEY, int(time.time() * 1000))
+        return memcache.get(MEMCACHE_QUERY_GENERATION_KEY)
+
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
@@ -437,6 +765,26 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
+        self._checkRateLimit('queryConferences')
+
+        # serve the rendered result of an identical query if nothing changed since it was cached
+        queryKey = MEMCACHE_QUERY_KEY % self._canonicalQuery(request.filters)
+        cached = memcache.get_multi([MEMCACHE_QUERY_GENERATION_KEY, queryKey])
+        generation = self._queryGeneration(cached.get(MEMCACHE_QUERY_GENERATION_KEY))
+        if queryKey in cached and generation is not None and cached[queryKey][0] == generation:
+            return protojson.decode_message(ConferenceForms, cached[queryKey][1])
+
+        forms = self._queryConferenceForms(request)
+        if generation is not None:
+            try:
+                memcache.set(queryKey, (generation, protojson.encode_message(forms)), QUERY_CACHE_TIME)
+            except ValueError:
+                # results over the memcache value limit are served uncached
+                logging.info('Query result too large to cache: %s' % queryKey)
+        return forms
+
+    def _queryConferenceForms(self, request):
+        """Run the query of the submitted filters and return its ConferenceForms."""
         conferences = self._getQuery(request)
 
         # need to fetch organiser displayName from profiles
@@ -455,6 +803,283 @@ class ConferenceApi(remote.Service):
                 conferences]
         )
 
+# - - - Calendar - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _calendarMonths(startDate, endDate):
+        """Return (year, month) tuples for every month between startDate and endDate inclusive."""
+        months = []
+        year, month = startDate.year, startDate.month
+        while (year, month) <= (endDate.year, endDate.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return months
+
+    @staticmethod
+    def _buildCalendarBucket(year, month):
+        """Build the sorted (startDate, websafeKey) bucket of a month from the datastore."""
+        firstDay = date(year, month, 1)
+        nextFirstDay = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+
+        # a single inequality on startDate only needs the built-in property index
+        confs = Conference.query(ndb.AND(
+            Conference.startDate >= firstDay,
+            Conference.startDate < nextFirstDay)
+        ).order(Conference.startDate).fetch(projection=[Conference.startDate])
+
+        return [(str(conf.startDate), conf.key.urlsafe()) for conf in confs]
+
+    @staticmethod
+    def _getCalendarBuckets(months):
+        """Return the calendar buckets of the given months, rebuilding those missing from memcache.
+        The query may not see a conference written moments ago yet, so a bucket rebuilt for a month
+        written to in the last CALENDAR_SETTLE_TIME is only cached that long."""
+        keys = [MEMCACHE_CALENDAR_KEY % (year, month) for year, month in months]
+        writtenKeys = [MEMCACHE_CALENDAR_WRITTEN_KEY % (year, month) for year, month in months]
+        buckets = memcache.get_multi(keys + writtenKeys)
+
+        rebuilt, settling = {}, {}
+        for key, writtenKey, (year, month) in zip(keys, writtenKeys, months):
+            if key not in buckets:
+                bucket = ConferenceApi._buildCalendarBucket(year, month)
+                buckets[key] = bucket
+                (settling if writtenKey in buckets else rebuilt)[key] = bucket
+
+        # add rather than set so that a concurrent incremental update is not overwritten
+        if rebuilt:
+            memcache.add_multi(rebuilt, time=CALENDAR_CACHE_TIME)
+        if settling:
+            memcache.add_multi(settling, time=CALENDAR_SETTLE_TIME)
+
+        return [buckets[key] for key in keys]
+
+    @staticmethod
+    def _updateCalendarIndex(websafeConferenceKey, oldStartDate, newStartDate):
+        """Move a conference between cached calendar buckets after it is created or updated.
+        The buckets touched expire after CALENDAR_SETTLE_TIME, so that they are rebuilt once the
+        query sees the write, and so does a bucket rebuilt from a query that may not see it yet."""
+        if oldStartDate == newStartDate:
+            return
+
+        client = memcache.Client()
+        for startDate, add in ((oldStartDate, False), (newStartDate, True)):
+            if not startDate:
+                continue
+            client.set(MEMCACHE_CALENDAR_WRITTEN_KEY % (startDate.year, startDate.month), True,
+                       time=CALENDAR_SETTLE_TIME)
+            key = MEMCACHE_CALENDAR_KEY % (startDate.year, startDate.month)
+            for i in range(MEMCACHE_CAS_RETRIES):
+                bucket = client.gets(key)
+                if bucket is None:
+                    # not cached; it will be rebuilt on the next read
+                    break
+                bucket = [entry for entry in bucket if entry[1] != websafeConferenceKey]
+                if add:
+                    bucket.append((str(startDate), websafeConferenceKey))
+                    bucket.sort()
+                if client.cas(key, bucket, time=CALENDAR_SETTLE_TIME):
+                    break
+            else:
+                # too much contention, drop the bucket and let the next read rebuild it
+                memcache.delete(key)
+
+    def _getConferencesInWindow(self, startDate, endDate):
+        """Return ConferenceForms, sorted by startDate, of conferences starting between startDate and endDate."""
+        if startDate > endDate:
+            raise endpoints.BadRequestException("'startDate' must not be after 'endDate'")
+        months = ConferenceApi._calendarMonths(startDate, endDate)
+        if len(months) > CALENDAR_MAX_MONTHS:
+            raise endpoints.BadRequestException('Date range cannot span more than %d months' % CALENDAR_MAX_MONTHS)
+
+        # buckets are in month order and sorted within, so the result is already sorted
+        start, end = str(startDate), str(endDate)
+        websafeKeys = [websafeKey for bucket in ConferenceApi._getCalendarBuckets(months)
+                       for startStr, websafeKey in bucket if start <= startStr <= end]
+
+        confs = ndb.get_multi([ndb.Key(urlsafe=websafeKey) for websafeKey in websafeKeys])
+        return self._copyConferencesToForms([conf for conf in confs if conf])
+
+    @endpoints.method(CONF_GET_REQUEST_WITH_DATE, ConferenceForms,
+            path='conferencesByDate/{startDate}/{endDate}',
+            http_method='GET', name='getConferencesByDate')
+    def getConferencesByDate(self, request):
+        """Return conferences starting within a date range, sorted by start date"""
+        try:
+            startDate = datetime.strptime(request.startDate[:10], '%Y-%m-%d').date()
+            endDate = datetime.strptime(request.endDate[:10], '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            raise endpoints.BadRequestException('Dates must be in the form YYYY-MM-DD')
+
+        return self._getConferencesInWindow(startDate, endDate)
+
+    @endpoints.method(CONF_GET_UPCOMING_REQUEST, ConferenceForms,
+            path='conferences/upcoming',
+            http_method='GET', name='getUpcomingConferences')
+    def getUpcomingConferences(self, request):
+        """Return conferences starting in the next few days (default 30), sorted by start date"""
+        days = request.days or CALENDAR_UPCOMING_DAYS
+        today = date.today()
+        return self._getConferencesInWindow(today, today + timedelta(days=days))
+
+# - - - Facets - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _facetCells(conf):
+        """Return the (city, topics, month) counter cells a conference is counted in: one cell, keyed
+        by its sorted topics, so that filtering on topics never counts a conference twice."""
+        return [(conf.city, tuple(sorted(set(conf.topics))), conf.month)]
+
+    @staticmethod
+    def _topicsMatch(topics, topicFilters):
+        """Return whether a conference with the given topics matches the topic filters the way the
+        datastore matches a repeated property: every equality filter by some topic, and all other
+        filters by one and the same topic."""
+        equalities = [f["value"] for f in topicFilters if f["operator"] == '=']
+        inequalities = [f for f in topicFilters if f["operator"] != '=']
+        if not all(value in topics for value in equalities):
+            return False
+        return not inequalities or any(all(FACET_OPERATORS[f["operator"]](topic, f["value"]) for f in inequalities)
+                                       for topic in topics)
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateFacetCounts(oldCells, newCells):
+        """Apply the difference between old and new cells of a conference to a random counter shard.
+        Joins the caller's transaction if there is one."""
+        delta = {}
+        for cell in oldCells:
+            delta[cell] = delta.get(cell, 0) - 1
+        for cell in newCells:
+            delta[cell] = delta.get(cell, 0) + 1
+        delta = dict((cell, n) for cell, n in delta.items() if n)
+        if not delta:
+            return
+
+        # spread writes over shards to avoid contention on a single entity group
+        shardKey = ndb.Key(ConferenceFacetShard, random.randint(1, FACET_SHARDS))
+        shard = shardKey.get() or ConferenceFacetShard(key=shardKey)
+        counts = dict(shard.counts or {})
+        for cell, n in delta.items():
+            counts[cell] = counts.get(cell, 0) + n
+            if not counts[cell]:
+                del counts[cell]
+        shard.counts = counts
+        shard.put()
+
+        ndb.get_context().call_on_commit(lambda: memcache.delete(MEMCACHE_FACETS_KEY))
+
+    @staticmethod
+    def _facetShardKeys():
+        """Return the keys of all facet counter shards."""
+        return [ndb.Key(ConferenceFacetShard, i) for i in range(1, FACET_SHARDS + 1)]
+
+    @staticmethod
+    def _sumFacetShards(shards):
+        """Return the combined (city, topics, month) counters of the given shards."""
+        counts = {}
+        for shard in shards:
+            if shard:
+                for cell, n in (shard.counts or {}).items():
+                    counts[cell] = counts.get(cell, 0) + n
+        return counts
+
+    @staticmethod
+    def _getFacetCounts():
+        """Return the combined (city, topics, month) counters, from memcache if possible."""
+        counts = memcache.get(MEMCACHE_FACETS_KEY)
+        if counts is None:
+            counts = ConferenceApi._sumFacetShards(ndb.get_multi(ConferenceApi._facetShardKeys()))
+            try:
+                memcache.add(MEMCACHE_FACETS_KEY, counts)
+            except ValueError:
+                # counters over the memcache value limit are served uncached
+                logging.info('Facet counters too large to cache: %d cells' % len(counts))
+        return counts
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _correctFacetCounts(before, rebuilt):
+        """Apply the difference between rebuilt counters and the stored ones to the first shard, in one
+        transaction over all shards. Cells whose stored count moved away from before, the count when the
+        rebuild started, were changed during the rebuild; they keep their deltas and are left for the next
+        run. Return the number of cells corrected."""
+        shardKeys = ConferenceApi._facetShardKeys()
+        shards = [shard or ConferenceFacetShard(key=key, counts={})
+                  for key, shard in zip(shardKeys, ndb.get_multi(shardKeys))]
+        current = ConferenceApi._sumFacetShards(shards)
+        counts = dict(shards[0].counts or {})
+        corrected = 0
+        for cell in set(before) | set(rebuilt) | set(current):
+            n = current.get(cell, 0)
+            if n == before.get(cell, 0) and n != rebuilt.get(cell, 0):
+                counts[cell] = counts.get(cell, 0) + rebuilt.get(cell, 0) - n
+                if not counts[cell]:
+                    del counts[cell]
+                corrected += 1
+        if corrected:
+            shards[0].counts = counts
+            shards[0].put()
+            ndb.get_context().call_on_commit(lambda: memcache.delete(MEMCACHE_FACETS_KEY))
+        return corrected
+
+    @staticmethod
+    def _recomputeFacetCounts():
+        """Recount the facet counters from the Conference entities and correct the cells that drifted;
+        used by the facets cron job. Conferences change while the query runs, so the recount is applied
+        as deltas rather than overwriting the shards and losing the updates made meanwhile."""
+        before = ConferenceApi._sumFacetShards(ndb.get_multi(ConferenceApi._facetShardKeys()))
+        rebuilt = {}
+        for conf in Conference.query().iter(batch_size=500):
+            for cell in ConferenceApi._facetCells(conf):
+                rebuilt[cell] = rebuilt.get(cell, 0) + 1
+
+        corrected = ConferenceApi._correctFacetCounts(before, rebuilt)
+        logging.info('Recomputed conference facets: %d cells, %d corrected' % (len(rebuilt), corrected))
+
+    @staticmethod
+    def _copyFacetCountsToForms(counts):
+        """Return FacetCountForms sorted by descending count, then value"""
+        return [FacetCountForm(value='%s' % value, count=count)
+                for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+    @endpoints.method(ConferenceQueryForms, ConferenceFacetsForm,
+            path='conferenceFacets',
+            http_method='POST', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, topic and month for the given filters"""
+        inequality_field, filters = self._formatFilters(request.filters)
+        for filtr in filters:
+            if filtr["field"] == "maxAttendees":
+                raise endpoints.BadRequestException("Facet counts cannot be filtered on maxAttendees.")
+            if filtr["field"] == "month":
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (ValueError, TypeError):
+                    raise endpoints.BadRequestException("Month filter value must be an integer.")
+        topicFilters = [f for f in filters if f["field"] == "topics"]
+        otherFilters = [f for f in filters if f["field"] != "topics"]
+
+        cities, topics, months = {}, {}, {}
+        for (city, cellTopics, month), n in ConferenceApi._getFacetCounts().items():
+            if n <= 0:
+                continue
+            values = {'city': city, 'month': month}
+            if not all(FACET_OPERATORS[f["operator"]](values[f["field"]], f["value"]) for f in otherFilters):
+                continue
+            if not ConferenceApi._topicsMatch(cellTopics, topicFilters):
+                continue
+
+            cities[city] = cities.get(city, 0) + n
+            months[month] = months.get(month, 0) + n
+            for topic in cellTopics:
+                topics[topic] = topics.get(topic, 0) + n
+
+        return ConferenceFacetsForm(
+            cities=self._copyFacetCountsToForms(cities),
+            topics=self._copyFacetCountsToForms(topics),
+            months=self._copyFacetCountsToForms(months)
+        )
+
     # ============================================
     # MY TASK 1 ADDITIONS ========================
 
@@ -473,6 +1098,11 @@ class ConferenceApi(remote.Service):
         # convert Speaker properties to SpeakerForm fields
         sf.name = speaker.name
         sf.bio = speaker.bio
+        sf.sessionCount = len(speaker.sessions)
+        sf.conferenceCount = len(speaker.conferences)
+        if speaker.nextSession:
+            sf.websafeNextSessionKey = speaker.nextSession.urlsafe()
+            sf.nextSessionStart = speaker.nextSessionStart.isoformat()
         sf.websafeKey = speaker.key.urlsafe()
 
         # check and return
@@ -501,6 +1131,7 @@ class ConferenceApi(remote.Service):
             bio = request.bio
         )
         speaker.put()
+        ConferenceApi._dropSpeakerDirectory()
 
         # return SpeakerForm
         return self._copySpeakerToForm(speaker)
@@ -512,27 +1143,192 @@ class ConferenceApi(remote.Service):
         """Return speaker"""
 
         # get Speaker object using key
-        speakerKey, speaker = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeSpeakerKey, Speaker)
+        speakerKey, speaker = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeSpeakerKey, Speaker, cached=True)
+        speaker = ConferenceApi._advanceNextSessions([speaker])[0]
 
         # return SpeakerForm
         return self._copySpeakerToForm(speaker)
 
+    @staticmethod
+    @ndb.transactional()
+    def _setNextSession(speakerKey, staleStart, session):
+        """Replace a speaker's next session that started at staleStart with session (None if there is none);
+        return the stored Speaker. Left alone if a new session already replaced it."""
+        speaker = speakerKey.get()
+        if speaker and speaker.nextSessionStart == staleStart:
+            speaker.nextSession = session.key if session else None
+            speaker.nextSessionStart = session.start if session else None
+            speaker.put()
+        return speaker
+
+    @staticmethod
+    def _advanceNextSessions(speakers):
+        """Return speakers with every next session that has started moved on to the speaker's following
+        session, saving the ones that changed. The given entities may be cached, so they are not modified."""
+        now = datetime.now()
+        stale = [speaker for speaker in speakers if speaker.nextSessionStart and speaker.nextSessionStart < now]
+        if not stale:
+            return speakers
+        sessionKeys = list(set(sessionKey for speaker in stale for sessionKey in speaker.sessions))
+        sessions = dict((session.key, session) for session in ndb.get_multi(sessionKeys) if session)
+        for session in sessions.values():
+            ConferenceApi._upgradeSession(session)
+
+        advanced = {}
+        for speaker in stale:
+            upcoming = [sessions[sessionKey] for sessionKey in speaker.sessions
+                        if sessionKey in sessions and sessions[sessionKey].start >= now]
+            nextSession = min(upcoming, key=lambda session: session.start) if upcoming else None
+            stored = ConferenceApi._setNextSession(speaker.key, speaker.nextSessionStart, nextSession)
+            if stored:
+                advanced[speaker.key] = stored
+                SPEAKER_CACHE.invalidate(speaker.key.urlsafe())
+        return [advanced.get(speaker.key, speaker) for speaker in speakers]
+
+    @staticmethod
+    def _mapSpeakerStats(sessions, counters):
+        """Mapper job: count a batch of sessions in the stats of their speakers, to backfill sessions
+        created before speakers had stats."""
+        changed = 0
+        for session in sessions:
+            ConferenceApi._upgradeSession(session)
+            for speakerKey in session.speakers:
+                if ConferenceApi._addSessionToSpeaker(speakerKey, session):
+                    SPEAKER_CACHE.invalidate(speakerKey.urlsafe())
+                    changed += 1
+        if changed:
+            ConferenceApi._dropSpeakerDirectory()
+        counters['sessions'] = counters.get('sessions', 0) + len(sessions)
+        counters['added'] = counters.get('added', 0) + changed
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSessionToSpeaker(speakerKey, session):
+        """Count a session in a speaker's stats; adding the same session again changes nothing."""
+        speaker = speakerKey.get()
+        if not speaker or session.key in speaker.sessions:
+            return False
+
+        speaker.sessions.append(session.key)
+        if session.key.parent() not in speaker.conferences:
+            speaker.conferences.append(session.key.parent())
+
+        # keep the earliest session that has not started yet
+        now = datetime.now()
+        if session.start >= now and (not speaker.nextSessionStart or speaker.nextSessionStart < now
+                                     or session.start < speaker.nextSessionStart):
+            speaker.nextSession = session.key
+            speaker.nextSessionStart = session.start
+        speaker.put()
+        return True
+
+    @staticmethod
+    def _updateSpeakerStats(websafeSessionKey):
+        """Add a new session to the stats of its speakers; used by the update speaker stats task."""
+        session = ndb.Key(urlsafe=websafeSessionKey).get()
+        if not session:
+            return
+        ConferenceApi._upgradeSession(session)
+        changed = [speakerKey for speakerKey in session.speakers
+                   if ConferenceApi._addSessionToSpeaker(speakerKey, session)]
+        for speakerKey in changed:
+            SPEAKER_CACHE.invalidate(speakerKey.urlsafe())
+        if changed:
+            ConferenceApi._dropSpeakerDirectory()
+
+    @staticmethod
+    def _dropSpeakerDirectory():
+        """Delete the cached speaker directory so that it is rebuilt on the next read."""
+        pageCount = memcache.get(MEMCACHE_SPEAKER_PAGES_KEY)
+        if pageCount:
+            memcache.delete_multi([MEMCACHE_SPEAKER_PAGE_KEY % page for page in range(pageCount)])
+        memcache.delete(MEMCACHE_SPEAKER_PAGES_KEY)
+
+    def _buildSpeakerDirectory(self):
+        """Build every page of the speaker directory, sorted by name, and cache them; return the pages."""
+        speakers = ConferenceApi._advanceNextSessions(Speaker.query().order(Speaker.name).fetch())
+        forms = [self._copySpeakerToForm(speaker) for speaker in speakers]
+        pageCount = max(1, (len(forms) + SPEAKER_PAGE_SIZE - 1) // SPEAKER_PAGE_SIZE)
+        pages = [protojson.encode_message(SpeakerPageForm(
+                    items=forms[page * SPEAKER_PAGE_SIZE:(page + 1) * SPEAKER_PAGE_SIZE],
+                    page=page,
+                    pageCount=pageCount))
+                 for page in range(pageCount)]
+
+        cached = dict((MEMCACHE_SPEAKER_PAGE_KEY % page, data) for page, data in enumerate(pages))
+        cached[MEMCACHE_SPEAKER_PAGES_KEY] = pageCount
+        memcache.add_multi(cached, time=SPEAKER_DIRECTORY_CACHE_TIME)
+        return pages
+
+    @endpoints.method(SPEAKER_LIST_REQUEST, SpeakerPageForm,
+            path='speakers',
+            http_method='GET', name='listSpeakers')
+    def listSpeakers(self, request):
+        """Return a page of the speaker directory, sorted by name"""
+        page = request.page or 0
+        if page < 0:
+            raise endpoints.BadRequestException("'page' must not be negative")
+        cached = memcache.get_multi([MEMCACHE_SPEAKER_PAGE_KEY % page, MEMCACHE_SPEAKER_PAGES_KEY])
+        data = cached.get(MEMCACHE_SPEAKER_PAGE_KEY % page)
+        if data is None:
+            # only rebuild for a page that exists, or when the page count is unknown
+            pageCount = cached.get(MEMCACHE_SPEAKER_PAGES_KEY)
+            if pageCount is None or page < pageCount:
+                pages = self._buildSpeakerDirectory()
+                pageCount = len(pages)
+            if page >= pageCount:
+                raise endpoints.NotFoundException('No speaker directory page %d' % page)
+            data = pages[page]
+        return protojson.decode_message(SpeakerPageForm, data)
+
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _upgradeSession(session):
+        """Convert a Session still in the legacy string schema to the compact schema in place.
+        Return whether anything changed."""
+        if session.startMinutes is not None:
+            return False
+
+        session.speakers = [ndb.Key(urlsafe=websafeKey) for websafeKey in session.speakerKeys]
+        session.typeCode = getattr(SessionTypes, session.typeOfSession or 'NOT_SPECIFIED').number
+        session.startMinutes = session.startTime.hour * 60 + session.startTime.minute
+        session.start = datetime.combine(session.date, session.startTime)
+
+        # unset the legacy fields, so they are no longer written
+        session.speakerKeys = []
+        del session.typeOfSession, session.date, session.startTime
+        return True
+
+    def _querySessions(self, query, legacyQuery):
+        """Return the sessions matched by query on the compact schema, plus those matched by
+        legacyQuery on the legacy schema while SESSION_LEGACY_READS is on."""
+        sessions = query.fetch()
+        if SESSION_LEGACY_READS:
+            seen = set(session.key for session in sessions)
+            sessions.extend(session for session in legacyQuery if session.key not in seen)
+        for session in sessions:
+            ConferenceApi._upgradeSession(session)
+        return sessions
+
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm"""
 
+        # read sessions not migrated yet
+        ConferenceApi._upgradeSession(session)
+
         # create a new entity first
         sf = SessionForm()
 
         # convert Session properties to SessionForm fields
         sf.name = session.name
         sf.highlights = session.highlights
-        sf.speakerKeys = session.speakerKeys
+        sf.speakerKeys = [speakerKey.urlsafe() for speakerKey in session.speakers]
         sf.duration = session.duration
-        sf.typeOfSession = getattr(SessionTypes, session.typeOfSession)
-        sf.date = str(session.date)
-        sf.startTime = int('%s%s' % (str(session.startTime)[:2], str(session.startTime)[3:5]))
+        sf.typeOfSession = SessionTypes(session.typeCode)
+        sf.date = str(session.start.date())
+        sf.startTime = session.startMinutes // 60 * 100 + session.startMinutes % 60
         sf.websafeKey = session.key.urlsafe()
 
         # check and return
@@ -551,14 +1347,18 @@ class ConferenceApi(remote.Service):
     def getConferenceSessions(self, request):
         """Return all sessions of a given conference"""
 
-        # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        def compute():
+            # get the conference using websafeConferenceKey
+            confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+                request.websafeConferenceKey, Conference, cached=True)
 
-        # get sessions of this conference
-        sessions = Session.query(ancestor=confKey)
+            # get sessions of this conference
+            sessions = Session.query(ancestor=confKey)
 
-        # return SessionForms
-        return self._copySessionsToForms(sessions)
+            # return SessionForms
+            return self._copySessionsToForms(sessions)
+
+        return self._getCoalesced('getConferenceSessions', request.websafeConferenceKey, SessionForms, compute)
 
     @endpoints.method(SESSION_GET_CONF_REQUEST_WITH_TYPE, SessionForms,
             path='session/{websafeConferenceKey}/{typeOfSession}',
@@ -567,11 +1367,13 @@ class ConferenceApi(remote.Service):
         """Return all sessions of a given conference by type"""
 
         # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeConferenceKey, Conference, cached=True)
 
         # get sessions of this conference, filtered by type
-        sessions = Session.query(ancestor=confKey)
-        sessions = sessions.filter(Session.typeOfSession == request.typeOfSession.name)
+        sessions = self._querySessions(
+            Session.query(ancestor=confKey).filter(Session.typeCode == request.typeOfSession.number),
+            Session.query(ancestor=confKey).filter(Session.typeOfSession == request.typeOfSession.name))
 
         # return SessionForms
         return self._copySessionsToForms(sessions)
@@ -581,17 +1383,19 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Return all sessions given by a speaker, across all conferences"""
+        self._checkRateLimit('getSessionsBySpeaker')
 
         # find websafe key for matching speaker
         speakers = Speaker.query()
         speakers = speakers.filter(Speaker.name == request.speakerName.title())
         if speakers.count() == 0:
             return SessionForms()
-        speakerWebsafeUrl = speakers.get().key.urlsafe()
+        speakerKey = speakers.get().key
 
-        # query using websafe speaker key, filter with speaker in title case for case-independent query
-        sessions = Session.query()
-        sessions = sessions.filter(speakerWebsafeUrl == Session.speakerKeys)  #IN filter
+        # query using speaker key, filter with speaker in title case for case-independent query
+        sessions = self._querySessions(
+            Session.query(Session.speakers == speakerKey),  #IN filter
+            Session.query(Session.speakerKeys == speakerKey.urlsafe()))
 
         # return SessionForms
         return self._copySessionsToForms(sessions)
@@ -622,36 +1426,48 @@ class ConferenceApi(remote.Service):
 
         # check that speaker keys are valid
         for speakerWebsafeKey in request.speakerKeys:
-            speakerKey, speaker = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(speakerWebsafeKey, Speaker)
+            speakerKey, speaker = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+                speakerWebsafeKey, Speaker, cached=True)
 
         # start building a data dictionary
         data = {}
         data['name'] = request.name
         data['highlights'] = request.highlights
-        data['speakerKeys'] = request.speakerKeys
+        data['speakers'] = [ndb.Key(urlsafe=speakerWebsafeKey) for speakerWebsafeKey in request.speakerKeys]
         data['duration'] = request.duration
-        data['typeOfSession'] = request.typeOfSession.name
-        data['date'] = datetime.strptime(request.date[:10], '%Y-%m-%d').date()
-        data['startTime'] = datetime.strptime(str(request.startTime)[:4], '%H%M').time()
+        data['typeCode'] = request.typeOfSession.number
+        sessionDate = datetime.strptime(request.date[:10], '%Y-%m-%d').date()
+        startTime = datetime.strptime(str(request.startTime)[:4], '%H%M').time()
+        data['startMinutes'] = startTime.hour * 60 + startTime.minute
+        data['start'] = datetime.combine(sessionDate, startTime)
 
         # create a custom unique key, with the conference key as ancestor
         s_id = Session.allocate_ids(size=1, parent=confKey)[0]
         s_key = ndb.Key(Session, s_id, parent=confKey)
         data['key'] = s_key
 
-        # write session object to datastore
         session = Session(**data)
-        session.put()
+        tasks = TaskBuffer()
 
         # trigger a task to update featured speaker
-        taskqueue.add(
+        tasks.add(
             params={
                 'websafeConferenceKey': request.websafeConferenceKey,
+                'websafeSessionKey': s_key.urlsafe(),
                 'websafeSpeakerKeys': '&'.join(request.speakerKeys)
             },
             url='/tasks/update_featured_speaker'
         )
 
+        # and tasks to update the stats of its speakers & add it to the upcoming sessions index
+        tasks.add(params={'websafeSessionKey': s_key.urlsafe()}, url='/tasks/update_speaker_stats')
+        tasks.add(params={'websafeSessionKey': s_key.urlsafe()}, url='/tasks/index_session')
+
+        # write session object to datastore, together with its tasks
+        ConferenceApi._putWithTasks([session], tasks, 'create')
+        memcache.delete(MEMCACHE_COALESCE_KEY % ('getConferenceSessions', request.websafeConferenceKey))
+        ConferenceApi._bumpCalendarVersion('conference_%s' % request.websafeConferenceKey)
+
         # return SessionForm
         return self._copySessionToForm(session)
 
@@ -670,21 +1486,30 @@ class ConferenceApi(remote.Service):
         # get user id + auth check
         user_id = self._getUserId()
 
-        # get user
-        user = ndb.Key(Profile, user_id).get()
-
         # get session using websafe key (to check that it exists)
         sessionKey, session = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeSessionKey, Session)
 
-        # add session websafe key to wishlist
-        if session.key.urlsafe() in user.sessions:
-            raise endpoints.ConflictException("Session has already been added to user's wishlist")
-        user.sessions.append(session.key.urlsafe())
-        user.put()
+        # add session key to wishlist
+        calendarToken = ConferenceApi._addToWishlist(ndb.Key(Profile, user_id), sessionKey)
+        if calendarToken:
+            ConferenceApi._bumpCalendarVersion('wishlist_%s' % calendarToken)
 
         # return SessionForm
         return self._copySessionToForm(session)
 
+    @staticmethod
+    @ndb.transactional()
+    def _addToWishlist(profKey, sessionKey):
+        """Add a session to a profile's wishlist, returning the profile's calendar token. Transactional, so that
+        it cannot lose a concurrent change to the profile, such as a new calendar token."""
+        user = profKey.get()
+        ConferenceApi._upgradeProfile(user)
+        if sessionKey in user.wishlist:
+            raise endpoints.ConflictException("Session has already been added to user's wishlist")
+        user.wishlist.append(sessionKey)
+        user.put()
+        return user.calendarToken
+
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='wishlist',
             http_method='GET', name='getSessionsInWishlist')
@@ -696,9 +1521,10 @@ class ConferenceApi(remote.Service):
 
         # get user
         user = ndb.Key(Profile, user_id).get()
+        ConferenceApi._upgradeProfile(user)
 
         # return SessionForms
-        return self._copySessionsToForms(ndb.get_multi([ConferenceApi._getKeyFromWebsafeKey(sessionWebsafeKey) for sessionWebsafeKey in user.sessions]))
+        return self._copySessionsToForms([session for session in ndb.get_multi(user.wishlist) if session])
 
     # END OF MY TASK 2 ADDITIONS =================
     # ============================================
@@ -713,15 +1539,19 @@ class ConferenceApi(remote.Service):
         """Return all sessions of a given conference by date range"""
 
         # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeConferenceKey, Conference, cached=True)
 
         # convert date string to python date
         startDate = datetime.strptime(request.startDate[:10], '%Y-%m-%d').date()
         endDate = datetime.strptime(request.endDate[:10], '%Y-%m-%d').date()
 
         # get sessions of this conference, filtered by date range
-        sessions = Session.query(ancestor=confKey)
-        sessions = sessions.filter(ndb.AND(Session.date>=startDate, Session.date<=endDate))
+        sessions = self._querySessions(
+            Session.query(ancestor=confKey).filter(ndb.AND(
+                Session.start>=datetime.combine(startDate, datetime.min.time()),
+                Session.start<datetime.combine(endDate + timedelta(days=1), datetime.min.time()))),
+            Session.query(ancestor=confKey).filter(ndb.AND(Session.date>=startDate, Session.date<=endDate)))
 
         # return SessionForms
         return self._copySessionsToForms(sessions)
@@ -733,15 +1563,19 @@ class ConferenceApi(remote.Service):
         """Return all sessions of a given conference by daily time range"""
 
         # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeConferenceKey, Conference, cached=True)
 
         # convert time integer to python time
         startTime = datetime.strptime(str(request.startTime)[:4], '%H%M').time()
         endTime = datetime.strptime(str(request.endTime)[:4], '%H%M').time()
 
         # get sessions of this conference, filtered by time range
-        sessions = Session.query(ancestor=confKey)
-        sessions = sessions.filter(ndb.AND(Session.startTime>=startTime, Session.startTime<=endTime))
+        sessions = self._querySessions(
+            Session.query(ancestor=confKey).filter(ndb.AND(
+                Session.startMinutes>=startTime.hour * 60 + startTime.minute,
+                Session.startMinutes<=endTime.hour * 60 + endTime.minute)),
+            Session.query(ancestor=confKey).filter(ndb.AND(Session.startTime>=startTime, Session.startTime<=endTime)))
 
         # return SessionForms
         return self._copySessionsToForms(sessions)
@@ -753,19 +1587,22 @@ class ConferenceApi(remote.Service):
         """Return all sessions of a given conference that is not of type antiTypeOfSession and is before lastestTime"""
 
         # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeConferenceKey, Conference, cached=True)
 
         # convert time integer to python time
         latestTime = datetime.strptime(str(request.latestTime)[:4], '%H%M').time()
 
         # get sessions of this conference, filtered by type
-        sessions = Session.query(ancestor=confKey)
-        sessions = sessions.filter(Session.typeOfSession != request.antiTypeOfSession.name)
+        sessions = self._querySessions(
+            Session.query(ancestor=confKey).filter(Session.typeCode != request.antiTypeOfSession.number),
+            Session.query(ancestor=confKey).filter(Session.typeOfSession != request.antiTypeOfSession.name))
 
         # filter second equality using Python instead of going through datastore query (because it's not possible at all)
         # this is ok in this application because the number of sessions in a conference will not be too large
         # so using Python (which is slower) to post-process the query results won't be too slow
-        sessions = [s for s in sessions if s.startTime <= latestTime]
+        latestMinutes = latestTime.hour * 60 + latestTime.minute
+        sessions = [s for s in sessions if s.startMinutes <= latestMinutes]
 
         # return SessionForms
         return self._copySessionsToForms(sessions)
@@ -773,67 +1610,362 @@ class ConferenceApi(remote.Service):
     # END OF MY TASK 3 ADDITIONS =================
     # ============================================
 
-# - - - Featured Speakers - - - - - - - - - - - - - - - - - - - -
+# - - - Calendar feeds - - - - - - - - - - - - - - - - - - - -
 
-    # ============================================
-    # MY TASK 4 ADDITIONS ========================
+    @staticmethod
+    def _nextCalendarVersion(version=None):
+        """Return a version stamp later than version, or than the current second when version is unknown.
+        Stamps are whole seconds in milliseconds, so the Last-Modified of every version is different."""
+        second = int(time.time())
+        if version is None:
+            second += 1
+        else:
+            second = max(second, version // 1000 + 1)
+        return second * 1000
 
     @staticmethod
-    def _updateFeaturedSpeaker(websafeConferenceKey, websafeSpeakerKeys):
-        """Update featured speaker if conditions are met"""
+    def _calendarVersion(feedId):
+        """Return the version stamp of a calendar feed, the time it last changed in milliseconds.
+        A stamp lost from memcache is replaced by a later one, so clients fetch the feed once more."""
+        version = memcache.get(MEMCACHE_ICAL_VERSION_KEY % feedId)
+        if version is None:
+            memcache.add(MEMCACHE_ICAL_VERSION_KEY % feedId, ConferenceApi._nextCalendarVersion())
+            version = memcache.get(MEMCACHE_ICAL_VERSION_KEY % feedId) or ConferenceApi._nextCalendarVersion()
+        return version
 
-        # get the conference using websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(websafeConferenceKey, Conference)
+    @staticmethod
+    def _bumpCalendarVersion(feedId):
+        """Mark a calendar feed as changed, moving its version stamp to a later second."""
+        key = MEMCACHE_ICAL_VERSION_KEY % feedId
+        client = memcache.Client()
+        for i in range(MEMCACHE_CAS_RETRIES):
+            version = client.gets(key)
+            if version is None:
+                if client.add(key, ConferenceApi._nextCalendarVersion()):
+                    return
+            elif client.cas(key, ConferenceApi._nextCalendarVersion(version)):
+                return
+        # contended; the next read replaces the lost stamp with a later one
+        client.delete(key)
 
-        # extract keys array from combined string
-        websafeSpeakerKeys = websafeSpeakerKeys.split('&')
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _getCalendarToken(profKey):
+        """Return the wishlist calendar token of a profile, creating it and its CalendarToken the first time."""
+        prof = profKey.get()
+        if not prof.calendarToken:
+            prof.calendarToken = uuid.uuid4().hex
+            ndb.put_multi([prof, CalendarToken(id=prof.calendarToken, profileKey=profKey)])
+        return prof.calendarToken
 
-        # check if speaker has more than 1 session in this conference
-        sessions = Session.query(ancestor=confKey)
-        counters = {}
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+            path='wishlist/calendar',
+            http_method='GET', name='getWishlistCalendar')
+    def getWishlistCalendar(self, request):
+        """Return the path of the iCalendar feed of the user's wishlist, to subscribe to in calendar apps"""
+        prof = self._getProfileFromUser()  # get user Profile
+        return StringMessage(data='/ical/wishlist/%s' % ConferenceApi._getCalendarToken(prof.key))
+
+    @staticmethod
+    def _calendarSessions(feedType, feedKey):
+        """Return (calendar name, lazy iterable of sessions) of a calendar feed, or None if there is no such feed.
+        Sessions are read ICAL_BATCH_SIZE at a time as the feed is written."""
+        if feedType == 'wishlist':
+            token = ndb.Key(CalendarToken, feedKey).get()
+            prof = token and token.profileKey.get()
+            if not prof or prof.calendarToken != feedKey:
+                return None
+            ConferenceApi._upgradeProfile(prof)
+            wishlist = prof.wishlist
+
+            def sessions():
+                for i in range(0, len(wishlist), ICAL_BATCH_SIZE):
+                    for session in ndb.get_multi(wishlist[i:i + ICAL_BATCH_SIZE]):
+                        if session:
+                            yield session
+            return 'Wishlist of %s' % (prof.displayName or 'Conference Central'), sessions()
+
+        try:
+            conf = ndb.Key(urlsafe=feedKey).get()
+        except (ProtocolBufferDecodeError, TypeError):
+            return None
+        if not isinstance(conf, Conference):
+            return None
+        return conf.name, Session.query(ancestor=conf.key).iter(batch_size=ICAL_BATCH_SIZE)
+
+    @staticmethod
+    def _icalText(text):
+        """Escape text for an iCalendar property value."""
+        return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+    @staticmethod
+    def _icalLine(line):
+        """Return a content line folded at 75 octets, with its line break."""
+        line = line.encode('utf-8') if isinstance(line, unicode) else line
+        folded = []
+        while len(line) > 75:
+            cut = 75
+            # never split a UTF-8 sequence
+            while cut > 1 and (ord(line[cut]) & 0xc0) == 0x80:
+                cut -= 1
+            folded.append(line[:cut])
+            line = ' ' + line[cut:]
+        folded.append(line)
+        return '\r\n'.join(folded) + '\r\n'
+
+    @staticmethod
+    def _iterCalendar(name, sessions):
+        """Generate an iCalendar document of sessions a few lines at a time."""
+        line = ConferenceApi._icalLine
+        text = ConferenceApi._icalText
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        yield ''.join([line('BEGIN:VCALENDAR'), line('VERSION:2.0'),
+                       line('PRODID:-//Conference Central//Sessions//EN'),
+                       line('X-WR-CALNAME:%s' % text(name))])
+        for session in sessions:
+            ConferenceApi._upgradeSession(session)
+            event = [line('BEGIN:VEVENT'),
+                     line('UID:%s@conference-central' % session.key.urlsafe()),
+                     line('DTSTAMP:%s' % stamp),
+                     line('DTSTART:%s' % session.start.strftime('%Y%m%dT%H%M%S')),
+                     line('SUMMARY:%s' % text(session.name))]
+            if session.duration:
+                event.append(line('DURATION:PT%dM' % session.duration))
+            if session.highlights:
+                event.append(line('DESCRIPTION:%s' % text(session.highlights)))
+            event.append(line('END:VEVENT'))
+            yield ''.join(event)
+        yield line('END:VCALENDAR')
+
+# - - - Upcoming sessions - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _sessionBucketKeys(hour):
+        """Return the keys of all shards of the session index bucket of an hour."""
+        return [ndb.Key(SessionHourBucket, '%s_%d' % (hour.strftime('%Y%m%d%H'), i))
+                for i in range(SESSION_INDEX_SHARDS)]
+
+    @staticmethod
+    def _sessionBucketKey(session):
+        """Return the key of the session index bucket shard a session belongs in."""
+        shard = (zlib.crc32(session.key.urlsafe()) & 0xffffffff) % SESSION_INDEX_SHARDS
+        return ConferenceApi._sessionBucketKeys(session.start)[shard]
+
+    @staticmethod
+    @ndb.transactional()
+    def _addToSessionBucket(bucketKey, sessionKeys):
+        """Add session keys to a session index bucket shard; keys already in it are skipped."""
+        bucket = bucketKey.get() or SessionHourBucket(key=bucketKey)
+        added = [key for key in sessionKeys if key not in bucket.sessions]
+        if added:
+            bucket.sessions.extend(added)
+            bucket.put()
+
+    @staticmethod
+    def _indexSessions(sessions):
+        """Add sessions to the buckets of the hours they start in."""
+        byBucket = {}
+        for session in sessions:
+            ConferenceApi._upgradeSession(session)
+            byBucket.setdefault(ConferenceApi._sessionBucketKey(session), []).append(session.key)
+        for bucketKey, sessionKeys in byBucket.items():
+            ConferenceApi._addToSessionBucket(bucketKey, sessionKeys)
+
+    @staticmethod
+    def _indexSession(websafeSessionKey):
+        """Add a new session to the upcoming sessions index; used by the index session task."""
+        session = ndb.Key(urlsafe=websafeSessionKey).get()
+        if session:
+            ConferenceApi._indexSessions([session])
+
+    @staticmethod
+    def _mapSessionIndex(sessions, counters):
+        """Mapper job: add a batch of sessions to the upcoming sessions index, to backfill it."""
+        ConferenceApi._indexSessions(sessions)
+        counters['sessions'] = counters.get('sessions', 0) + len(sessions)
+
+    @staticmethod
+    def _pruneSessionIndex():
+        """Delete session index buckets of hours more than SESSION_INDEX_RETENTION_DAYS ago;
+        used by the session index cron job."""
+        cutoff = (datetime.now() - timedelta(days=SESSION_INDEX_RETENTION_DAYS)).strftime('%Y%m%d%H')
+        while True:
+            keys = SessionHourBucket.query(SessionHourBucket.key < ndb.Key(SessionHourBucket, cutoff)).fetch(
+                500, keys_only=True)
+            ndb.delete_multi(keys)
+            if len(keys) < 500:
+                break
+
+    @endpoints.method(SESSION_GET_UPCOMING_REQUEST, SessionForms,
+            path='sessions/upcoming',
+            http_method='GET', name='getUpcomingSessions')
+    def getUpcomingSessions(self, request):
+        """Return sessions starting in the next few hours (default 1) of all conferences the user attends"""
+        user_id = self._getUserId()
+        hours = min(request.hours or 1, SESSION_INDEX_MAX_HOURS)
+        prof = ndb.Key(Profile, user_id).get()
+        if not prof:
+            return SessionForms()
+        ConferenceApi._upgradeProfile(prof)
+        attending = set(prof.conferencesToAttend)
+
+        # read the buckets of every hour in the window, then keep the sessions of attended conferences
+        now = datetime.now()
+        end = now + timedelta(hours=hours)
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        bucketKeys = []
+        while hour <= end:
+            bucketKeys.extend(ConferenceApi._sessionBucketKeys(hour))
+            hour += timedelta(hours=1)
+        sessionKeys = [key for bucket in ndb.get_multi(bucketKeys) if bucket
+                       for key in bucket.sessions if key.parent() in attending]
+
+        sessions = [session for session in ndb.get_multi(sessionKeys) if session]
         for session in sessions:
+            ConferenceApi._upgradeSession(session)
+        sessions = [session for session in sessions if now <= session.start <= end]
+        sessions.sort(key=lambda session: session.start)
+        return self._copySessionsToForms(sessions)
+
+# - - - Featured Speakers - - - - - - - - - - - - - - - - - - - -
+
+    # ============================================
+    # MY TASK 4 ADDITIONS ========================
 
-            for websafeSpeakerKey in websafeSpeakerKeys:
+    @staticmethod
+    def _rankFeaturedSpeakers(counts, ranking=None, changed=()):
+        """Return the FEATURED_SPEAKERS_K speakers with the most sessions, if more than one,
+        as [(websafe speaker key, sessions)] with the most sessions first. Given the previous ranking and
+        the speakers whose counts changed since, only those are merged into it, unless a ranked speaker
+        lost a session and someone else may have to move up."""
+        if ranking is not None:
+            ranked = dict(ranking)
+            if not any(counts.get(websafeSpeakerKey, 0) < ranked[websafeSpeakerKey]
+                       for websafeSpeakerKey in changed if websafeSpeakerKey in ranked):
+                ranked.update((websafeSpeakerKey, counts.get(websafeSpeakerKey, 0)) for websafeSpeakerKey in changed)
+                counts = ranked
+        top = heapq.nlargest(FEATURED_SPEAKERS_K,
+            ((sessions, websafeSpeakerKey) for websafeSpeakerKey, sessions in counts.items() if sessions > 1))
+        return [(websafeSpeakerKey, sessions) for sessions, websafeSpeakerKey in top]
 
-                # init counter for this key if it does not already exist
-                if websafeSpeakerKey not in counters:
-                    counters[websafeSpeakerKey] = 0
+    @staticmethod
+    def _countSpeakerSessions(sessions):
+        """Count the sessions of every speaker from scratch; return ({websafe speaker key: sessions},
+        [websafe keys of the sessions counted])."""
+        counts = {}
+        for session in sessions:
+            ConferenceApi._upgradeSession(session)
+            for speakerKey in session.speakers:
+                counts[speakerKey.urlsafe()] = counts.get(speakerKey.urlsafe(), 0) + 1
+        return counts, [session.key.urlsafe() for session in sessions]
 
-                # check if this speaker key is in this session's speakers key list
-                if websafeSpeakerKey in session.speakerKeys:
+    @staticmethod
+    def _putFeatured(featured):
+        """Store a conference's FeaturedSpeakers and put its ranking in memcache once that commits."""
+        featured.put()
+        ranking = featured.ranking
+        ndb.get_context().call_on_commit(lambda: memcache.set(MEMCACHE_FEATURED_KEY % featured.key.id(), ranking))
 
-                    # increment counter
-                    counters[websafeSpeakerKey] += 1
+    @staticmethod
+    @ndb.transactional()
+    def _storeFeaturedCounts(websafeConferenceKey, counts, websafeSessionKeys):
+        """Replace the session counts of the speakers of a conference with counts made from scratch over
+        the given sessions, re-rank its featured speakers and return the ranking; used by the mapper."""
+        featured = FeaturedSpeakers(
+            key=ndb.Key(FeaturedSpeakers, websafeConferenceKey),
+            counts=dict((websafeSpeakerKey, sessions) for websafeSpeakerKey, sessions in counts.items() if sessions),
+            sessions=websafeSessionKeys,
+        )
+        featured.ranking = ConferenceApi._rankFeaturedSpeakers(featured.counts)
+        ConferenceApi._putFeatured(featured)
+        return featured.ranking
 
-                    # if found more than 1, set memcache to speaker and return (no need to check anymore)
-                    if counters[websafeSpeakerKey] > 1:
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _countFeaturedSession(websafeConferenceKey, websafeSessionKey, websafeSpeakerKeys, add=True):
+        """Add one to, or take one from, the session counts of the speakers of a new or deleted session
+        and merge them into the featured ranking, which is returned. Sessions counted are kept with the
+        counts, so each one is counted once however often this runs and in whatever order."""
+        key = ndb.Key(FeaturedSpeakers, websafeConferenceKey)
+        featured = key.get() or FeaturedSpeakers(key=key, counts={}, sessions=[], ranking=[])
+
+        counted = websafeSessionKey in featured.sessions
+        if add and not counted and ndb.Key(urlsafe=websafeSessionKey).get():
+            featured.sessions.append(websafeSessionKey)
+            delta = 1
+        elif not add and counted:
+            featured.sessions.remove(websafeSessionKey)
+            delta = -1
+        else:
+            return featured.ranking
 
-                        # set memcache
-                        memcache.set('%s_featuredSpeaker' % websafeConferenceKey, websafeSpeakerKey)
+        for websafeSpeakerKey in websafeSpeakerKeys:
+            sessions = featured.counts.get(websafeSpeakerKey, 0) + delta
+            if sessions > 0:
+                featured.counts[websafeSpeakerKey] = sessions
+            else:
+                featured.counts.pop(websafeSpeakerKey, None)
+        featured.ranking = ConferenceApi._rankFeaturedSpeakers(featured.counts, featured.ranking, websafeSpeakerKeys)
+        ConferenceApi._putFeatured(featured)
+        return featured.ranking
 
-                        # log that we have found featured speaker for this conference
-                        speaker = ndb.Key(urlsafe=websafeSpeakerKey).get()
-                        logging.info('Setting featured speaker of conference %s (%s) to %s (%s)' % (websafeConferenceKey, conf.name, websafeSpeakerKey, speaker.name))
+    @staticmethod
+    def _getFeaturedRankings(websafeConferenceKeys):
+        """Return {websafe conference key: featured speaker ranking}, read through memcache."""
+        cached = memcache.get_multi(websafeConferenceKeys, key_prefix=MEMCACHE_FEATURED_KEY % '')
+        missing = [wsck for wsck in websafeConferenceKeys if wsck not in cached]
+        if missing:
+            stored = ndb.get_multi([ndb.Key(FeaturedSpeakers, wsck) for wsck in missing])
+            loaded = dict((wsck, featured.ranking if featured else []) for wsck, featured in zip(missing, stored))
+            memcache.add_multi(loaded, key_prefix=MEMCACHE_FEATURED_KEY % '')
+            cached.update(loaded)
+        return cached
 
-                        return
+    @staticmethod
+    def _updateFeaturedSpeaker(websafeConferenceKey, websafeSessionKey, websafeSpeakerKeys, add=True):
+        """Count a new session, or uncount a deleted one, for its speakers and re-rank the conference's
+        featured speakers"""
 
-        # log that no featured speaker has been set
-        logging.info('No featured speaker set')
+        # extract keys array from combined string
+        websafeSpeakerKeys = [websafeSpeakerKey for websafeSpeakerKey in websafeSpeakerKeys.split('&')
+                              if websafeSpeakerKey]
+
+        ranking = ConferenceApi._countFeaturedSession(websafeConferenceKey, websafeSessionKey, websafeSpeakerKeys, add)
+        logging.info('Featured speakers of conference %s: %s' % (websafeConferenceKey, ranking))
+
+    def _copyFeaturedSpeakersToForms(self, ranking):
+        """Return FeaturedSpeakerForms for a featured speaker ranking."""
+        items = []
+        for websafeSpeakerKey, sessions in ranking:
+            speaker = SPEAKER_CACHE.get(websafeSpeakerKey, lambda websafeKey: ndb.Key(urlsafe=websafeKey).get())
+            if speaker:
+                items.append(FeaturedSpeakerForm(speaker=self._copySpeakerToForm(speaker), sessions=sessions))
+        return FeaturedSpeakerForms(items=items)
+
+    @endpoints.method(SESSION_GET_FEATURED_SPEAKER_REQUEST, FeaturedSpeakerForms,
+            path='speaker/featured/{websafeConferenceKey}/top',
+            http_method='GET', name='getFeaturedSpeakers')
+    def getFeaturedSpeakers(self, request):
+        """Return the speakers of a conference with the most sessions, with their number of sessions"""
+        ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference, cached=True)
+        ranking = ConferenceApi._getFeaturedRankings([request.websafeConferenceKey])[request.websafeConferenceKey]
+        return self._copyFeaturedSpeakersToForms(ranking)
 
     @endpoints.method(SESSION_GET_FEATURED_SPEAKER_REQUEST, SpeakerForm,
             path='speaker/featured/{websafeConferenceKey}',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return featured speaker of a conference from memcache"""
+        """Return featured speaker of a conference, the one with the most sessions"""
 
         # check type of websafeConferenceKey
-        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(
+            request.websafeConferenceKey, Conference, cached=True)
 
-        # get featured speaker using key from memcache
-        websafeFeaturedSpeakerKey = memcache.get('%s_featuredSpeaker' % request.websafeConferenceKey)
-        if websafeFeaturedSpeakerKey:
-            featuredSpeaker = ndb.Key(urlsafe=websafeFeaturedSpeakerKey).get()
-            return self._copySpeakerToForm(featuredSpeaker)
+        # the featured speaker is the top of the ranking
+        ranking = ConferenceApi._getFeaturedRankings([request.websafeConferenceKey])[request.websafeConferenceKey]
+        featured = self._copyFeaturedSpeakersToForms(ranking[:1]).items
+        if featured:
+            return featured[0].speaker
 
         # return empty speaker form on failure for no results
         return SpeakerForm()
@@ -843,12 +1975,38 @@ class ConferenceApi(remote.Service):
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _upgradeProfile(prof):
+        """Move the legacy websafe key lists of a Profile into its key lists in place.
+        Invalid legacy keys are logged and dropped. Return whether anything changed."""
+        if not (prof.conferenceKeysToAttend or prof.sessions):
+            return False
+
+        for legacy, keys in ((prof.conferenceKeysToAttend, prof.conferencesToAttend),
+                             (prof.sessions, prof.wishlist)):
+            for websafeKey in legacy:
+                try:
+                    key = ndb.Key(urlsafe=websafeKey)
+                except (ProtocolBufferDecodeError, TypeError):
+                    logging.warning('Dropping invalid key %r of profile %s' % (websafeKey, prof.key.id()))
+                    continue
+                if key not in keys:
+                    keys.append(key)
+        prof.conferenceKeysToAttend = []
+        prof.sessions = []
+        return True
+
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
         pf = ProfileForm()
         for field in pf.all_fields():
-            if hasattr(prof, field.name):
+            # convert key lists to websafe keys
+            if field.name == 'conferenceKeysToAttend':
+                pf.conferenceKeysToAttend = ConferenceApi._getWebsafeKeys(prof.conferencesToAttend)
+            elif field.name == 'sessions':
+                pf.sessions = ConferenceApi._getWebsafeKeys(prof.wishlist)
+            elif hasattr(prof, field.name):
                 # convert t-shirt string to Enum; just copy others
                 if field.name == 'teeShirtSize':
                     setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
@@ -865,40 +2023,127 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # get Profile from datastore
+        # get Profile from datastore, creating it in one transaction; get_or_insert tries a plain get
+        # first, so only a missing profile pays for the transaction
         user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
-        # create new Profile if not there
-        if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(),
-                mainEmail= user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
+        profile = Profile.get_or_insert(user_id,
+            displayName = user.nickname(),
+            mainEmail= user.email(),
+            teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+        )
+        ConferenceApi._upgradeProfile(profile)
 
         return profile      # return Profile
 
 
+    @staticmethod
+    def _newerProfileChanges(prof, changes):
+        """Return the {field: value} of the {field: (value, edit time)} changes made after the last
+        edit of their field that was written to prof."""
+        editTimes = prof.editTimes or {}
+        return dict((field, val) for field, (val, edited) in changes.items() if edited > editTimes.get(field, 0))
+
+    @staticmethod
+    def _mergeProfileChanges(pending, changes):
+        """Merge {field: (value, edit time)} changes into pending ones, keeping the latest edit of each field."""
+        merged = dict(pending)
+        for field, (val, edited) in changes.items():
+            if field not in merged or merged[field][1] < edited:
+                merged[field] = (val, edited)
+        return merged
+
+    @staticmethod
+    def _queueProfileChanges(user_id, changes):
+        """Merge profile changes into the pending set in memcache and queue a flush task carrying them.
+        The first task of a PROFILE_WRITE_BEHIND_DELAY window writes every edit made in it; the others
+        only write if memcache lost some of them."""
+        now = time.time()
+        changes = dict((field, (val, now)) for field, val in changes.items())
+        key = MEMCACHE_PROFILE_CHANGES_KEY % user_id
+        client = memcache.Client()
+        for i in range(MEMCACHE_CAS_RETRIES):
+            pending = client.gets(key)
+            if pending is None:
+                if client.add(key, changes):
+                    break
+                continue
+            if client.cas(key, ConferenceApi._mergeProfileChanges(pending, changes)):
+                break
+        else:
+            # memcache is too contended to buffer the edit, write it through instead
+            ConferenceApi._applyProfileChanges(user_id, changes)
+            return
+
+        # the edit travels with its task, so it is written even if memcache drops it
+        window = int(now // PROFILE_WRITE_BEHIND_DELAY)
+        taskqueue.add(
+            params={'userId': user_id, 'changes': json.dumps(changes)},
+            url='/tasks/flush_profile',
+            countdown=(window + 1) * PROFILE_WRITE_BEHIND_DELAY - now
+        )
+
+    @staticmethod
+    @ndb.transactional()
+    def _applyProfileChanges(user_id, changes):
+        """Write {field: (value, edit time)} profile changes to the datastore, skipping those older than
+        what was already written and the put if nothing is newer."""
+        prof = ndb.Key(Profile, user_id).get()
+        if not prof:
+            return
+        newer = ConferenceApi._newerProfileChanges(prof, changes)
+        if newer:
+            editTimes = dict(prof.editTimes or {})
+            editTimes.update((field, changes[field][1]) for field in newer)
+            prof.populate(editTimes=editTimes, **newer)
+            prof.put()
+            if 'displayName' in newer:
+                ConferenceApi._organizerRenamed(user_id)
+
+    @staticmethod
+    def _flushProfileChanges(user_id, payload):
+        """Write the pending profile changes of a user together with those its task carries; used by the
+        write-behind flush task."""
+        key = MEMCACHE_PROFILE_CHANGES_KEY % user_id
+        client = memcache.Client()
+        pending = client.gets(key)
+        changes = ConferenceApi._mergeProfileChanges(pending or {}, json.loads(payload) if payload else {})
+        if not changes:
+            return
+        ConferenceApi._applyProfileChanges(user_id, changes)
+
+        # if newer edits came in meanwhile, leave them for their own tasks
+        if pending:
+            client.cas(key, {})
+
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
         prof = self._getProfileFromUser()
 
-        # if saveProfile(), process user-modifyable fields
+        # apply edits still waiting to be written behind
+        if PROFILE_WRITE_BEHIND:
+            prof.populate(**ConferenceApi._newerProfileChanges(
+                prof, memcache.get(MEMCACHE_PROFILE_CHANGES_KEY % prof.key.id()) or {}))
+
+        # if saveProfile(), gather changed user-modifyable fields and write them once
         if save_request:
+            changes = {}
             for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+                val = getattr(save_request, field, None)
+                if val and str(val) != getattr(prof, field):
+                    changes[field] = str(val)
+
+            if changes:
+                prof.populate(**changes)
+                if PROFILE_WRITE_BEHIND:
+                    ConferenceApi._queueProfileChanges(prof.key.id(), changes)
+                else:
+                    prof.put()
+
+                # the organiser name of the user's own conferences is in feeds & in query results;
+                # written behind, they are refreshed when the change is written
+                if 'displayName' in changes and not PROFILE_WRITE_BEHIND:
+                    ConferenceApi._organizerRenamed(prof.key.id())
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -955,6 +2200,15 @@ class ConferenceApi(remote.Service):
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _seatsChanged(confKey):
+        """Drop the coalesced getConference response of a conference and queue the refresh of its attendees'
+        feeds once the current transaction commits, so that changed seats are not served stale."""
+        ctx = ndb.get_context()
+        ctx.call_on_commit(lambda: memcache.delete(
+            MEMCACHE_COALESCE_KEY % ('getConference', confKey.urlsafe())))
+        ctx.call_on_commit(lambda: ConferenceApi._queueFeedRefresh(confKey.urlsafe()))
+
     @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
@@ -972,28 +2226,31 @@ class ConferenceApi(remote.Service):
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if conf.key in prof.conferencesToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # check if seats avail, falling back to the seats parked in shards for holds
+            if not ConferenceApi._takeSeats(conf, 1):
                 raise ConflictException(
-                    "There are no seats available.")
+                    "There are no seats available. Join the waitlist instead.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            # register user
+            prof.conferencesToAttend.append(conf.key)
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if conf.key in prof.conferencesToAttend:
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
+                # unregister user, add back one seat and hand it to the next waiter
+                prof.conferencesToAttend.remove(conf.key)
                 conf.seatsAvailable += 1
+                taskqueue.add(params={'websafeConferenceKey': wsck},
+                    url='/tasks/promote_waitlist',
+                    transactional=True
+                )
                 retval = True
             else:
                 retval = False
@@ -1001,6 +2258,13 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
+        if retval:
+            ConferenceApi._logChange(conf.key, 'register' if reg else 'unregister')
+            ConferenceApi._seatsChanged(conf.key)
+            if reg:
+                ConferenceApi._changeFeed(prof.key.id(), 'attending', ConferenceApi._renderFeedEntries([conf]))
+            else:
+                ConferenceApi._changeFeed(prof.key.id(), 'attending', removeKeys=[wsck])
         return BooleanMessage(data=retval)
 
 
@@ -1009,23 +2273,10 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        user_id = self._getUserId()
 
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        # return set of ConferenceForm objects per Conference from the user's feed
+        return ConferenceApi._getFeedForms(user_id, 'attending')
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -1044,6 +2295,180 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
+    @staticmethod
+    def _unparkedSeats(conf):
+        """Return the seats available of a conference that are not parked in its seat shards."""
+        return (conf.seatsAvailable or 0) - (conf.seatsParked or 0)
+
+    @staticmethod
+    def _takeSeats(conf, seats):
+        """Take seats from a conference, first from those not parked, then from the seats parked in its seat
+        shards for holds. Call in a cross-group transaction; changed shards are put, the conference is left
+        for the caller to put. Return the number of free seats found; nothing is taken if that is too few."""
+        available = max(ConferenceApi._unparkedSeats(conf), 0)
+        fromShards = seats - min(seats, available)
+        shards = []
+        if fromShards:
+            shards = [shard for shard in ndb.get_multi(ConferenceApi._seatShardKeys(conf.key.urlsafe()))
+                      if shard and shard.seats > 0]
+            available += sum(shard.seats for shard in shards)
+            if available < seats:
+                return available
+
+        conf.seatsAvailable = (conf.seatsAvailable or 0) - seats
+        random.shuffle(shards)
+        changed = []
+        for shard in shards:
+            if not fromShards:
+                break
+            taken = min(fromShards, shard.seats)
+            shard.seats -= taken
+            conf.seatsParked -= taken
+            fromShards -= taken
+            changed.append(shard)
+        ndb.put_multi(changed)
+        return available
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _reserveGroupSeats(confKey, attendees):
+        """Take the seats of a group registration and record them in a GroupReservation, queueing the task that
+        settles it in the same transaction. Raise ConflictException if there are not enough seats left."""
+        conf = confKey.get()
+        available = ConferenceApi._takeSeats(conf, len(attendees))
+        if available < len(attendees):
+            raise ConflictException(
+                "There are only %d seats available." % available)
+        reservation = GroupReservation(parent=confKey, attendees=attendees)
+        ndb.put_multi([conf, reservation])
+        ConferenceApi._logChange(confKey, 'register')
+        ConferenceApi._seatsChanged(confKey)
+
+        # if the request dies before it settles the reservation, the task gives back the unused seats
+        taskqueue.add(params={'websafeReservationKey': reservation.key.urlsafe()},
+            url='/tasks/settle_group_reservation',
+            countdown=GROUP_REGISTRATION_SETTLE_SECONDS,
+            transactional=True
+        )
+        return reservation.key
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _settleGroupReservation(reservationKey, unused):
+        """Give back the unused seats of a group reservation and delete it; return whether it was still open.
+        The request and its fallback task both settle, so whichever comes second does nothing."""
+        if not reservationKey.get():
+            return False
+        reservationKey.delete()
+        conf = reservationKey.parent().get()
+        if conf and unused:
+            conf.seatsAvailable += unused
+            conf.put()
+            ConferenceApi._logChange(conf.key, 'unregister')
+            ConferenceApi._seatsChanged(conf.key)
+            # the returned seats may be wanted by someone on the waitlist
+            taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                url='/tasks/promote_waitlist',
+                transactional=True
+            )
+        return True
+
+    @staticmethod
+    def _settleAbandonedGroupReservation(websafeReservationKey):
+        """Give back the seats of the attendees of a group reservation who are not registered; used by the
+        settle group reservation task when the request that made the reservation did not settle it."""
+        reservationKey = ndb.Key(urlsafe=websafeReservationKey)
+        reservation = reservationKey.get()
+        if not reservation:
+            return
+        confKey = reservationKey.parent()
+        unused = 0
+        for prof in ndb.get_multi([ndb.Key(Profile, attendee) for attendee in reservation.attendees]):
+            if prof:
+                ConferenceApi._upgradeProfile(prof)
+            if not prof or confKey not in prof.conferencesToAttend:
+                unused += 1
+        if ConferenceApi._settleGroupReservation(reservationKey, unused):
+            logging.warning('Settled abandoned group reservation %s, %d seats given back' % (
+                websafeReservationKey, unused))
+
+    @staticmethod
+    @ndb.transactional_tasklet()
+    def _addConferenceToProfile(profKey, confKey):
+        """Add a conference to a profile's conferences to attend; the result says whether it was added."""
+        prof = yield profKey.get_async()
+        ConferenceApi._upgradeProfile(prof)
+        if confKey in prof.conferencesToAttend:
+            raise ndb.Return(False)
+        prof.conferencesToAttend.append(confKey)
+        yield prof.put_async(), ConferenceApi._feedKey(profKey.id()).delete_async()
+        ndb.get_context().call_on_commit(lambda: memcache.delete(MEMCACHE_FEED_KEY % profKey.id()))
+        raise ndb.Return(True)
+
+    @endpoints.method(CONF_GROUP_REGISTRATION_REQUEST, AttendeeRegistrationForms,
+            path='conference/{websafeConferenceKey}/group',
+            http_method='POST', name='registerGroupForConference')
+    def registerGroupForConference(self, request):
+        """Register a group of users for selected conference you created, returning the result per attendee."""
+        user_id = self._getUserId()
+
+        wsck = request.websafeConferenceKey
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(wsck, Conference)
+
+        # only the organiser may register other users
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException('Only the owner can register a group for the conference.')
+
+        attendees = []
+        for attendee in request.attendees:
+            if attendee not in attendees:
+                attendees.append(attendee)
+        if len(attendees) > GROUP_REGISTRATION_MAX:
+            raise endpoints.BadRequestException(
+                'At most %d attendees can be registered at once' % GROUP_REGISTRATION_MAX)
+
+        # weed out attendees who cannot be registered before touching the conference
+        results = {}
+        candidates = []
+        for attendee, prof in zip(attendees, ndb.get_multi([ndb.Key(Profile, a) for a in attendees])):
+            if not prof:
+                results[attendee] = RegistrationStatus.NO_PROFILE
+                continue
+            ConferenceApi._upgradeProfile(prof)
+            if confKey in prof.conferencesToAttend:
+                results[attendee] = RegistrationStatus.ALREADY_REGISTERED
+            else:
+                candidates.append(attendee)
+
+        # reserve all seats in a single transaction on the conference
+        if candidates:
+            reservationKey = ConferenceApi._reserveGroupSeats(confKey, candidates)
+
+        # then update the profiles in parallel batches, outside the seat-holding transaction
+        for i in range(0, len(candidates), GROUP_REGISTRATION_BATCH):
+            batch = candidates[i:i + GROUP_REGISTRATION_BATCH]
+            futures = [ConferenceApi._addConferenceToProfile(ndb.Key(Profile, a), confKey) for a in batch]
+            ndb.Future.wait_all(futures)
+            for attendee, future in zip(batch, futures):
+                if future.get_exception():
+                    logging.warning('Group registration of %s for %s failed: %s' % (
+                        attendee, wsck, future.get_exception()))
+                    results[attendee] = RegistrationStatus.FAILED
+                elif future.get_result():
+                    results[attendee] = RegistrationStatus.REGISTERED
+                else:
+                    results[attendee] = RegistrationStatus.ALREADY_REGISTERED
+
+        # compensate: give back the seats of attendees who did not end up registered
+        if candidates:
+            unused = len([a for a in candidates if results[a] != RegistrationStatus.REGISTERED])
+            ConferenceApi._settleGroupReservation(reservationKey, unused)
+
+        return AttendeeRegistrationForms(items=[
+            AttendeeRegistrationForm(attendee=attendee, status=results[attendee])
+            for attendee in attendees])
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
@@ -1064,4 +2489,1538 @@ class ConferenceApi(remote.Service):
         )
 
 
+# - - - Seat holds - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _seatShardKeys(wsck):
+        """Return the keys of all seat shards of a conference."""
+        return [ndb.Key(SeatShard, '%s_%d' % (wsck, i)) for i in range(SEAT_SHARDS)]
+
+    @staticmethod
+    def _copySeatHoldToForm(hold):
+        """Copy relevant fields from SeatHold to SeatHoldForm"""
+        return SeatHoldForm(
+            websafeKey=hold.key.urlsafe(),
+            websafeConferenceKey=hold.conferenceKey,
+            expires=hold.expires.isoformat()
+        )
+
+    @staticmethod
+    def _seatHoldKeys(wsck, user_id):
+        """Return the keys the seat hold of a user can have in the seat shards of a conference; a user
+        holds at most one seat per shard."""
+        return [ndb.Key(SeatHold, user_id, parent=shardKey) for shardKey in ConferenceApi._seatShardKeys(wsck)]
+
+    @staticmethod
+    @ndb.transactional()
+    def _holdSeatInShard(shardKey, user_id, wsck):
+        """Take a seat from a shard and create a SeatHold for it in the same entity group.
+        A hold the user still has in the shard is renewed instead, as its seat was never given back.
+        Return None if the shard has no seats left."""
+        expires = datetime.utcnow() + timedelta(seconds=SEAT_HOLD_SECONDS)
+        shard, hold = ndb.get_multi([shardKey, ndb.Key(SeatHold, user_id, parent=shardKey)])
+        if hold:
+            hold.expires = expires
+            hold.put()
+            return hold
+        if not shard or shard.seats <= 0:
+            return None
+        shard.seats -= 1
+        hold = SeatHold(
+            id=user_id,
+            parent=shardKey,
+            userId=user_id,
+            conferenceKey=wsck,
+            expires=expires
+        )
+        ndb.put_multi([shard, hold])
+        return hold
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _spreadSeats(confKey):
+        """Park all seats available of a conference in its seat shards, spread evenly, so that holds
+        never have to write the conference; return how many moved. Parked seats stay counted in
+        seatsAvailable, so the conference still reports them until they are confirmed."""
+        conf = confKey.get()
+        seats = max(ConferenceApi._unparkedSeats(conf), 0)
+        if not seats:
+            return 0
+        shardKeys = ConferenceApi._seatShardKeys(confKey.urlsafe())
+        shards = [shard or SeatShard(key=key) for key, shard in zip(shardKeys, ndb.get_multi(shardKeys))]
+        for i, shard in enumerate(shards):
+            shard.seats += seats // len(shards) + (1 if i < seats % len(shards) else 0)
+        conf.seatsParked = (conf.seatsParked or 0) + seats
+        ndb.put_multi([conf] + shards)
+        return seats
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _returnShardSeats(confKey, shardKey, idle):
+        """Move the seats of a seat shard not written since idle and without holds back to its conference,
+        deleting the shard; return how many seats moved."""
+        conf, shard = ndb.get_multi([confKey, shardKey])
+        if not conf or not shard or shard.updated >= idle or SeatHold.query(ancestor=shardKey).get(keys_only=True):
+            return 0
+        seats = shard.seats
+        shardKey.delete()
+        if not seats:
+            return 0
+        conf.seatsParked -= seats
+        conf.put()
+        # the returned seats may be wanted by someone on the waitlist
+        taskqueue.add(params={'websafeConferenceKey': confKey.urlsafe()},
+            url='/tasks/promote_waitlist',
+            transactional=True
+        )
+        return seats
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/hold/open',
+            http_method='POST', name='openSeatHolds')
+    def openSeatHolds(self, request):
+        """Spread the seats of a conference you created over its seat shards ahead of a ticket opening,
+        so that holds never contend on the conference. Seats not held for a day go back to it."""
+        user_id = self._getUserId()
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException('Only the owner can open seat holds for the conference.')
+        return BooleanMessage(data=bool(ConferenceApi._spreadSeats(confKey)))
+
+    @endpoints.method(CONF_GET_REQUEST, SeatHoldForm,
+            path='conference/{websafeConferenceKey}/hold',
+            http_method='POST', name='holdSeat')
+    def holdSeat(self, request):
+        """Hold a seat of selected conference for a few minutes until it is confirmed.
+        A user who already holds a seat of the conference gets that hold back."""
+        prof = self._getProfileFromUser() # get user Profile
+        user_id = prof.key.id()
+        wsck = request.websafeConferenceKey
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(wsck, Conference)
+        if confKey in prof.conferencesToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        now = datetime.utcnow()
+        for hold in ndb.get_multi(ConferenceApi._seatHoldKeys(wsck, user_id)):
+            if hold and hold.expires > now:
+                return ConferenceApi._copySeatHoldToForm(hold)
+
+        # try the shards that have seats in random order, moving on if one is contended
+        shardKeys = ConferenceApi._seatShardKeys(wsck)
+        random.shuffle(shardKeys)
+        contended = False
+        for attempt in range(2):
+            for shard in ndb.get_multi(shardKeys):
+                if shard and shard.seats > 0:
+                    try:
+                        hold = ConferenceApi._holdSeatInShard(shard.key, user_id, wsck)
+                    except datastore_errors.TransactionFailedError:
+                        contended = True
+                        continue
+                    if hold:
+                        return ConferenceApi._copySeatHoldToForm(hold)
+
+            # seat holds were not opened, or seats went back to the conference: spread them all at once
+            if attempt or contended or not ConferenceApi._unparkedSeats(conf) > 0:
+                break
+            try:
+                ConferenceApi._spreadSeats(confKey)
+            except datastore_errors.TransactionFailedError:
+                contended = True
+                break
+
+        if contended:
+            raise TooManyRequestsException('Too many seat holds at once, please try again.')
+        raise ConflictException(
+            "There are no seats available. Join the waitlist instead.")
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _confirmSeatHold(holdKey, user_id):
+        """Turn a seat hold into a registration of its user."""
+        hold = holdKey.get()
+        if not hold or hold.expires < datetime.utcnow():
+            raise endpoints.NotFoundException('Seat hold does not exist or has expired')
+        if hold.userId != user_id:
+            raise endpoints.ForbiddenException('Only the holder can confirm a seat hold')
+
+        prof = ndb.Key(Profile, user_id).get()
+        ConferenceApi._upgradeProfile(prof)
+        confKey = ndb.Key(urlsafe=hold.conferenceKey)
+        if confKey in prof.conferencesToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # the seat was already taken from the shard when it was held; it stops counting as available now
+        conf = confKey.get()
+        if not conf:
+            raise endpoints.NotFoundException('The conference of this seat hold no longer exists')
+        conf.seatsAvailable -= 1
+        conf.seatsParked -= 1
+        prof.conferencesToAttend.append(confKey)
+        ndb.put_multi([prof, conf])
+        hold.key.delete()
+        ConferenceApi._logChange(confKey, 'register')
+        ConferenceApi._seatsChanged(confKey)
+        ConferenceApi._dropFeed(user_id)
+
+    @endpoints.method(SEAT_HOLD_REQUEST, BooleanMessage,
+            path='hold/{websafeHoldKey}',
+            http_method='POST', name='confirmSeatHold')
+    def confirmSeatHold(self, request):
+        """Register user for the conference of a seat hold."""
+        user_id = self._getUserId()
+        holdKey = ConferenceApi._getKeyFromWebsafeKey(request.websafeHoldKey)
+        if holdKey.kind() != SeatHold.__name__:
+            raise endpoints.BadRequestException('Key %s does not refer to a seat hold' % request.websafeHoldKey)
+        ConferenceApi._confirmSeatHold(holdKey, user_id)
+        return BooleanMessage(data=True)
+
+    @staticmethod
+    @ndb.transactional()
+    def _releaseSeatHolds(shardKey, holdKeys, user_id=None):
+        """Delete holds of one shard and give their seats back to it; return how many were released.
+        If user_id is given, only holds of that user are released, otherwise only expired ones."""
+        shard = shardKey.get()
+        now = datetime.utcnow()
+        holds = [hold for hold in ndb.get_multi(holdKeys)
+                 if hold and (hold.userId == user_id if user_id else hold.expires < now)]
+        if holds:
+            shard.seats += len(holds)
+            shard.put()
+            ndb.delete_multi([hold.key for hold in holds])
+        return len(holds)
+
+    @endpoints.method(SEAT_HOLD_REQUEST, BooleanMessage,
+            path='hold/{websafeHoldKey}',
+            http_method='DELETE', name='releaseSeatHold')
+    def releaseSeatHold(self, request):
+        """Give up a seat hold before it expires."""
+        user_id = self._getUserId()
+        holdKey = ConferenceApi._getKeyFromWebsafeKey(request.websafeHoldKey)
+        if holdKey.kind() != SeatHold.__name__:
+            raise endpoints.BadRequestException('Key %s does not refer to a seat hold' % request.websafeHoldKey)
+        released = ConferenceApi._releaseSeatHolds(holdKey.parent(), [holdKey], user_id)
+        return BooleanMessage(data=bool(released))
+
+    @staticmethod
+    def _sweepSeatHolds():
+        """Reclaim expired seat holds in batches, then return seats of shards idle for SEAT_SHARD_IDLE_SECONDS
+        to their conferences; used by the seat hold cron job."""
+        deadline = time.time() + SEAT_HOLD_SWEEP_SECONDS
+        reclaimed = 0
+        while time.time() < deadline:
+            holdKeys = SeatHold.query(SeatHold.expires < datetime.utcnow()).fetch(
+                SEAT_HOLD_SWEEP_BATCH, keys_only=True)
+            byShard = {}
+            for holdKey in holdKeys:
+                byShard.setdefault(holdKey.parent(), []).append(holdKey)
+            for shardKey, keys in byShard.items():
+                reclaimed += ConferenceApi._releaseSeatHolds(shardKey, keys)
+            if len(holdKeys) < SEAT_HOLD_SWEEP_BATCH:
+                break
+
+        # shards with holds belong to an ongoing sale and are left be
+        idle = datetime.utcnow() - timedelta(seconds=SEAT_SHARD_IDLE_SECONDS)
+        for shardKey in SeatShard.query(SeatShard.updated < idle).fetch(keys_only=True):
+            confKey = ndb.Key(urlsafe=shardKey.id().rsplit('_', 1)[0])
+            ConferenceApi._returnShardSeats(confKey, shardKey, idle)
+
+        logging.info('Reclaimed %d expired seat holds' % reclaimed)
+
+# - - - Waitlist - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _waitlistShardKeys(wsck):
+        """Return the keys of all waitlist shards of a conference."""
+        return [ndb.Key(WaitlistShard, '%s_%d' % (wsck, i)) for i in range(WAITLIST_SHARDS)]
+
+    @staticmethod
+    @ndb.transactional()
+    def _changeWaitlistShard(shardKey, user_id, add=True):
+        """Append a user to, or remove a user from, one waitlist shard; return whether it changed."""
+        shard = shardKey.get() or WaitlistShard(key=shardKey)
+        entries = shard.entries or []
+        if add:
+            entries.append((time.time(), user_id))
+        else:
+            remaining = [entry for entry in entries if entry[1] != user_id]
+            if len(remaining) == len(entries):
+                return False
+            entries = remaining
+        shard.entries = entries
+        shard.put()
+        return True
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='POST', name='joinWaitlist')
+    def joinWaitlist(self, request):
+        """Put user on the waitlist of a sold out conference."""
+        prof = self._getProfileFromUser() # get user Profile
+        user_id = prof.key.id()
+        wsck = request.websafeConferenceKey
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(wsck, Conference)
+
+        if confKey in prof.conferencesToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        seatShards = ndb.get_multi(ConferenceApi._seatShardKeys(wsck))
+        if ConferenceApi._unparkedSeats(conf) > 0 or any(shard and shard.seats > 0 for shard in seatShards):
+            raise ConflictException(
+                "There are seats available, register for the conference instead.")
+
+        shardKeys = ConferenceApi._waitlistShardKeys(wsck)
+        for shard in ndb.get_multi(shardKeys):
+            if shard and user_id in [entry[1] for entry in shard.entries or []]:
+                raise ConflictException(
+                    "You are already on the waitlist of this conference")
+
+        # a single write to a random shard keeps concurrent joins from colliding
+        ConferenceApi._changeWaitlistShard(random.choice(shardKeys), user_id)
+        return BooleanMessage(data=True)
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='DELETE', name='leaveWaitlist')
+    def leaveWaitlist(self, request):
+        """Take user off the waitlist of a conference."""
+        user_id = self._getUserId()
+        shardKeys = ConferenceApi._waitlistShardKeys(request.websafeConferenceKey)
+        retval = False
+        for shard in ndb.get_multi(shardKeys):
+            if shard and user_id in [entry[1] for entry in shard.entries or []]:
+                retval = ConferenceApi._changeWaitlistShard(shard.key, user_id, add=False) or retval
+        return BooleanMessage(data=retval)
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteWaiter(confKey, shardKey, entry):
+        """Give a free seat to one waitlist entry.
+        Return None if no seat is free, False if the entry could not be promoted, else the promoted Profile."""
+        conf = confKey.get()
+        if not conf or ConferenceApi._unparkedSeats(conf) <= 0:
+            return None
+
+        shard = shardKey.get()
+        if not shard or entry not in (shard.entries or []):
+            return False
+        shard.entries.remove(entry)
+
+        prof = ndb.Key(Profile, entry[1]).get()
+        if prof:
+            ConferenceApi._upgradeProfile(prof)
+        if not prof or confKey in prof.conferencesToAttend:
+            # nothing to promote; just drop the stale entry
+            shard.put()
+            return False
+
+        prof.conferencesToAttend.append(confKey)
+        conf.seatsAvailable -= 1
+        ndb.put_multi([shard, prof, conf])
+        ConferenceApi._logChange(confKey, 'register')
+        ConferenceApi._seatsChanged(confKey)
+        ConferenceApi._dropFeed(prof.key.id())
+        taskqueue.add(params={'email': prof.mainEmail,
+            'conferenceName': conf.name},
+            url='/tasks/send_waitlist_email',
+            transactional=True
+        )
+        return prof
+
+    @staticmethod
+    def _promoteFromWaitlist(wsck):
+        """Register the longest waiting users of a conference while it has free seats; used by the
+        promote waitlist task."""
+        confKey = ndb.Key(urlsafe=wsck)
+        shards = [shard for shard in ndb.get_multi(ConferenceApi._waitlistShardKeys(wsck)) if shard]
+
+        # merge the shards into one queue ordered by the time users joined
+        waiters = sorted((entry, shard.key) for shard in shards for entry in shard.entries or [])
+        for entry, shardKey in waiters:
+            prof = ConferenceApi._promoteWaiter(confKey, shardKey, entry)
+            if prof is None:
+                return
+            if prof:
+                logging.info('Promoted %s from the waitlist of %s' % (entry[1], wsck))
+
+# - - - Deletion - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _deleteConference(confKey):
+        """Delete a conference and queue the tasks that delete its sessions & release its attendees.
+        Only the conference itself is deleted here, so this takes the same time for any conference."""
+        conf = confKey.get()
+        if not conf:
+            return False
+        wsck = confKey.urlsafe()
+        tasks = TaskBuffer()
+        tasks.add(params={'websafeConferenceKey': wsck}, url='/tasks/delete_conference')
+        tasks.add(params={'websafeConferenceKey': wsck, 'conferenceName': conf.name},
+            url='/tasks/release_attendees')
+        rpc = tasks.flush_async(transactional=True)
+
+        confKey.delete()
+        ConferenceApi._logChange(confKey, 'delete')
+        ConferenceApi._updateFacetCounts(ConferenceApi._facetCells(conf), [])
+        ConferenceApi._changeFeed(conf.organizerUserId, 'created', removeKeys=[wsck])
+
+        ctx = ndb.get_context()
+        ctx.call_on_commit(lambda: ConferenceApi._updateCalendarIndex(wsck, conf.startDate, None))
+        ctx.call_on_commit(lambda: memcache.delete_multi([
+            MEMCACHE_COALESCE_KEY % ('getConference', wsck),
+            MEMCACHE_COALESCE_KEY % ('getConferenceSessions', wsck),
+            MEMCACHE_FEATURED_KEY % wsck]))
+        ctx.call_on_commit(lambda: CONFERENCE_CACHE.invalidate(wsck))
+        ctx.call_on_commit(lambda: ConferenceApi._bumpCalendarVersion('conference_%s' % wsck))
+        ctx.call_on_commit(ConferenceApi._bumpQueryGeneration)
+        if rpc:
+            rpc.get_result()
+        return True
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/delete',
+            http_method='DELETE', name='deleteConference')
+    def deleteConference(self, request):
+        """Delete a conference with its sessions; attendees are unregistered and notified in the background."""
+        user_id = self._getUserId()
+        confKey, conf = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeConferenceKey, Conference)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException('Only the owner can delete the conference.')
+        return BooleanMessage(data=ConferenceApi._deleteConference(confKey))
+
+    @staticmethod
+    def _deleteDescendants(ancestorKey, deadline, websafeCursor=None):
+        """Delete the entities under ancestorKey in keys-only batches until deadline, overlapping each
+        batch's deletes with fetching the next. Return the cursor to continue from, or None when done."""
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        query = ndb.Query(ancestor=ancestorKey)
+        futures = []
+        more = True
+        while more and time.time() < deadline:
+            keys, cursor, more = query.fetch_page(DELETE_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+            futures.extend(ndb.delete_multi_async(keys))
+            more = more and cursor
+        for future in futures:
+            future.get_result()
+        return cursor.urlsafe() if more else None
+
+    @staticmethod
+    def _deleteConferenceData(wsck, websafeCursor=None, shard=None):
+        """Delete the sessions & other descendants of a deleted conference, then the holds under each of its seat
+        shards in turn, and only then the seat & waitlist shards; used by the delete conference task. Each phase
+        starts in a task of its own and every task chains the next from where its DELETE_TASK_SECONDS ran out."""
+        confKey = ndb.Key(urlsafe=wsck)
+        deadline = time.time() + DELETE_TASK_SECONDS
+        chain = lambda params: taskqueue.add(params=dict(params, websafeConferenceKey=wsck),
+                                             url='/tasks/delete_conference')
+        if shard is None:
+            nextCursor = ConferenceApi._deleteDescendants(confKey, deadline, websafeCursor)
+            if nextCursor:
+                chain({'cursor': nextCursor})
+            else:
+                chain({'shard': 0})
+            return
+
+        shard = int(shard)
+        shardKeys = ConferenceApi._seatShardKeys(wsck)
+        while shard < len(shardKeys):
+            if time.time() >= deadline:
+                chain({'shard': shard})
+                return
+            nextCursor = ConferenceApi._deleteDescendants(shardKeys[shard], deadline, websafeCursor)
+            if nextCursor:
+                chain({'shard': shard, 'cursor': nextCursor})
+                return
+            shard += 1
+            websafeCursor = None
+        ndb.delete_multi(shardKeys + ConferenceApi._waitlistShardKeys(wsck) + [ndb.Key(FeaturedSpeakers, wsck)])
+        logging.info('Deleted the sessions of conference %s' % wsck)
+
+    @staticmethod
+    @ndb.transactional()
+    def _removeAttendance(profKey, confKey):
+        """Remove a deleted conference from a profile; return the profile if it was attending, else None."""
+        prof = profKey.get()
+        if not prof:
+            return None
+        ConferenceApi._upgradeProfile(prof)
+        if confKey not in prof.conferencesToAttend:
+            return None
+        prof.conferencesToAttend.remove(confKey)
+        prof.put()
+        ConferenceApi._dropFeed(profKey.id())
+        return prof
+
+    @staticmethod
+    def _releaseAttendees(wsck, conferenceName, websafeCursor=None, legacy=False):
+        """Unregister a batch of the attendees of a deleted conference, queue their notification emails
+        and chain a task for the next batch; profiles still on the legacy key list go last."""
+        confKey = ndb.Key(urlsafe=wsck)
+        if legacy:
+            query = Profile.query(Profile.conferenceKeysToAttend == wsck)
+        else:
+            query = Profile.query(Profile.conferencesToAttend == confKey)
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        profKeys, nextCursor, more = query.fetch_page(RELEASE_ATTENDEES_BATCH, keys_only=True, start_cursor=cursor)
+
+        tasks = TaskBuffer()
+        for profKey in profKeys:
+            prof = ConferenceApi._removeAttendance(profKey, confKey)
+            if prof and prof.mainEmail:
+                tasks.add(params={'email': prof.mainEmail, 'conferenceName': conferenceName},
+                    url='/tasks/send_cancellation_email')
+        tasks.flush()
+
+        params = {'websafeConferenceKey': wsck, 'conferenceName': conferenceName}
+        if more and nextCursor:
+            params.update(cursor=nextCursor.urlsafe(), legacy=legacy and '1' or '')
+        elif not legacy:
+            params.update(legacy='1')
+        else:
+            return
+        taskqueue.add(params=params, url='/tasks/release_attendees')
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _deleteSession(sessionKey):
+        """Delete a session with its recommendations; wishlists & speaker stats are cleaned up by the
+        reference sweeps."""
+        session = sessionKey.get()
+        if not session:
+            return False
+        wsck = sessionKey.parent().urlsafe()
+        ConferenceApi._upgradeSession(session)
+        taskqueue.add(params={'websafeConferenceKey': wsck,
+            'websafeSessionKey': sessionKey.urlsafe(),
+            'websafeSpeakerKeys': '&'.join(speakerKey.urlsafe() for speakerKey in session.speakers),
+            'remove': '1'},
+            url='/tasks/update_featured_speaker',
+            transactional=True
+        )
+        ndb.delete_multi([sessionKey, ConferenceApi._cooccurrenceKey(sessionKey)] +
+                         SessionNeighbours.query(ancestor=sessionKey).fetch(keys_only=True))
+        ConferenceApi._logChange(sessionKey, 'delete')
+        ndb.get_context().call_on_commit(lambda: memcache.delete(
+            MEMCACHE_COALESCE_KEY % ('getConferenceSessions', wsck)))
+        ndb.get_context().call_on_commit(lambda: ConferenceApi._bumpCalendarVersion('conference_%s' % wsck))
+        return True
+
+    @endpoints.method(SESSION_DELETE_REQUEST, BooleanMessage,
+            path='session/{websafeSessionKey}/delete',
+            http_method='DELETE', name='deleteSession')
+    def deleteSession(self, request):
+        """Delete a session of a conference you created"""
+        user_id = self._getUserId()
+        sessionKey, session = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeSessionKey, Session)
+        conf = sessionKey.parent().get()
+        if not conf or user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException('Only creator of the conference can delete its sessions')
+        return BooleanMessage(data=ConferenceApi._deleteSession(sessionKey))
+
+    @staticmethod
+    def _recomputeFeaturedSpeaker(wsck):
+        """Recount the featured speakers of a conference from scratch."""
+        conf = ndb.Key(urlsafe=wsck).get()
+        if conf:
+            ConferenceApi._mapFeaturedSpeakers([conf], {})
+
+    @staticmethod
+    def _missingKeys(keys):
+        """Return the set of keys among keys that have no entity."""
+        keys = list(set(keys))
+        return set(key for key, entity in zip(keys, ndb.get_multi(keys)) if not entity)
+
+    @staticmethod
+    @ndb.transactional()
+    def _dropProfileReferences(profKey, missing):
+        """Remove references to deleted conferences & sessions from a profile."""
+        prof = profKey.get()
+        ConferenceApi._upgradeProfile(prof)
+        prof.conferencesToAttend = [key for key in prof.conferencesToAttend if key not in missing]
+        prof.wishlist = [key for key in prof.wishlist if key not in missing]
+        prof.put()
+        ConferenceApi._dropFeed(profKey.id())
+        if prof.calendarToken:
+            ndb.get_context().call_on_commit(lambda: ConferenceApi._bumpCalendarVersion(
+                'wishlist_%s' % prof.calendarToken))
+
+    @staticmethod
+    def _mapProfileReferences(profiles, counters):
+        """Mapper job: drop references to deleted conferences & sessions from a batch of profiles."""
+        for prof in profiles:
+            ConferenceApi._upgradeProfile(prof)
+        missing = ConferenceApi._missingKeys(
+            [key for prof in profiles for key in prof.conferencesToAttend + prof.wishlist])
+        for prof in profiles:
+            if missing.intersection(prof.conferencesToAttend + prof.wishlist):
+                ConferenceApi._dropProfileReferences(prof.key, missing)
+                counters['profiles'] = counters.get('profiles', 0) + 1
+
+    @staticmethod
+    @ndb.transactional()
+    def _dropSpeakerReferences(speakerKey, missing, starts):
+        """Remove deleted sessions & conferences from a speaker's stats, picking a new next session
+        from starts ({session key: start}) if the next one was deleted."""
+        speaker = speakerKey.get()
+        speaker.sessions = [key for key in speaker.sessions if key not in missing]
+        speaker.conferences = [key for key in speaker.conferences if key not in missing]
+        if speaker.nextSession in missing:
+            now = datetime.now()
+            upcoming = sorted((starts[key], key) for key in speaker.sessions if starts.get(key) and starts[key] >= now)
+            speaker.nextSessionStart, speaker.nextSession = upcoming[0] if upcoming else (None, None)
+        speaker.put()
+
+    @staticmethod
+    def _mapSpeakerReferences(speakers, counters):
+        """Mapper job: drop deleted sessions & conferences from the stats of a batch of speakers."""
+        sessionKeys = list(set(key for speaker in speakers for key in speaker.sessions))
+        sessions = dict((key, session) for key, session in zip(sessionKeys, ndb.get_multi(sessionKeys)) if session)
+        missing = set(key for key in sessionKeys if key not in sessions)
+        missing |= ConferenceApi._missingKeys([key for speaker in speakers for key in speaker.conferences])
+        starts = {}
+        for key, session in sessions.items():
+            ConferenceApi._upgradeSession(session)
+            starts[key] = session.start
+
+        changed = [speaker for speaker in speakers if missing.intersection(speaker.sessions + speaker.conferences)]
+        for speaker in changed:
+            ConferenceApi._dropSpeakerReferences(speaker.key, missing, starts)
+            SPEAKER_CACHE.invalidate(speaker.key.urlsafe())
+        if changed:
+            ConferenceApi._dropSpeakerDirectory()
+        counters['speakers'] = counters.get('speakers', 0) + len(changed)
+
+# - - - Change log - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _logChange(key, operation):
+        """Write a change of the entity with the given key to the change log as an entity group of its own,
+        so concurrent changes never contend. Joins the caller's transaction, so the entry only exists if
+        the change commits."""
+        ChangeLogEntry(
+            kind=key.kind(),
+            websafeKey=key.urlsafe(),
+            operation=operation
+        ).put()
+
+    @staticmethod
+    def _parseChangesCursor(cursor):
+        """Return the time & id of the last seen change log entry from a changes cursor."""
+        if not cursor:
+            return datetime.utcfromtimestamp(0), 0
+        try:
+            micros, entryId = [int(part) for part in cursor.split('-')]
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid changes cursor: %s' % cursor)
+        return datetime.utcfromtimestamp(0) + timedelta(microseconds=micros), entryId
+
+    @staticmethod
+    def _changesCursor(created, entryId):
+        """Return the changes cursor that continues after the change log entry with the given time & id."""
+        delta = created - datetime.utcfromtimestamp(0)
+        return '%d-%d' % ((delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds, entryId)
+
+    @endpoints.method(CHANGES_GET_REQUEST, ChangeForms,
+            path='changes',
+            http_method='GET', name='getChangesSince')
+    def getChangesSince(self, request):
+        """Return the next batch of conference & session changes after a cursor (all changes if no cursor),
+        with the cursor to continue from. A cursor older than the retention window of the change log
+        gets no changes but resync set, and a cursor to continue from after a full resync."""
+        since, lastId = ConferenceApi._parseChangesCursor(request.cursor)
+        now = datetime.utcnow()
+        # entries are stamped before their transaction commits, so only hand out those old enough to have committed
+        settled = now - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+        if request.cursor and since < now - timedelta(days=CHANGELOG_RETENTION_DAYS):
+            return ChangeForms(cursor=ConferenceApi._changesCursor(settled, 0), resync=True)
+
+        query = ChangeLogEntry.query(ChangeLogEntry.created >= since).order(
+            ChangeLogEntry.created, ChangeLogEntry.key)
+        changes = []
+        cursor, more = None, True
+        while more and len(changes) < CHANGES_BATCH_SIZE:
+            entries, cursor, more = query.fetch_page(CHANGES_BATCH_SIZE, start_cursor=cursor)
+            for entry in entries:
+                if entry.created >= settled:
+                    more = False
+                    break
+                # skip what the client has seen among the entries stamped with the same time
+                if entry.created == since and entry.key.id() <= lastId:
+                    continue
+                changes.append(entry)
+                if len(changes) == CHANGES_BATCH_SIZE:
+                    break
+            more = more and cursor
+
+        if changes:
+            nextCursor = ConferenceApi._changesCursor(changes[-1].created, changes[-1].key.id())
+        else:
+            nextCursor = request.cursor or ''
+        return ChangeForms(
+            items=[ChangeForm(kind=entry.kind, websafeKey=entry.websafeKey,
+                              operation=entry.operation, created=entry.created.isoformat())
+                   for entry in changes],
+            cursor=nextCursor
+        )
+
+    @staticmethod
+    def _pruneChangeLog():
+        """Delete change log entries older than CHANGELOG_RETENTION_DAYS; used by the change log cron job."""
+        cutoff = datetime.utcnow() - timedelta(days=CHANGELOG_RETENTION_DAYS)
+        while True:
+            keys = ChangeLogEntry.query(ChangeLogEntry.created < cutoff).fetch(500, keys_only=True)
+            ndb.delete_multi(keys)
+            if len(keys) < 500:
+                break
+
+# - - - Conference feeds - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _feedKey(user_id):
+        """Return the key of a user's ConferenceFeed, which lives in the user's Profile entity group."""
+        return ndb.Key(ConferenceFeed, 1, parent=ndb.Key(Profile, user_id))
+
+    @staticmethod
+    def _renderFeedEntries(confs):
+        """Return (websafeKey, ConferenceForm JSON) feed entries for Conferences, with their organisers' names.
+        Organisers are the parents of their conferences, so this reads no other entity group."""
+        profiles = ndb.get_multi([conf.key.parent() for conf in confs])
+        return [(conf.key.urlsafe(), protojson.encode_message(
+                    ConferenceApi._copyConferenceToForm(conf, getattr(prof, 'displayName', None))))
+                for conf, prof in zip(confs, profiles)]
+
+    @staticmethod
+    def _buildFeed(user_id):
+        """Build and store a user's ConferenceFeed from the datastore."""
+        profKey = ndb.Key(Profile, user_id)
+        prof = profKey.get()
+        attending = []
+        if prof:
+            ConferenceApi._upgradeProfile(prof)
+            attending = [conf for conf in ndb.get_multi(prof.conferencesToAttend) if conf]
+        created = Conference.query(ancestor=profKey).fetch()
+
+        feed = ConferenceFeed(key=ConferenceApi._feedKey(user_id), entries={
+            'created': ConferenceApi._renderFeedEntries(created),
+            'attending': ConferenceApi._renderFeedEntries(attending),
+        })
+        feed.put()
+        return feed
+
+    @staticmethod
+    def _getFeedForms(user_id, field):
+        """Return ConferenceForms of the 'created' or 'attending' list of a user's feed, as stored.
+        Served from memcache, then the datastore copy, and only rebuilt when both are missing.
+        Seats and organiser names are kept current by refreshing the feeds when they change."""
+        entries = memcache.get(MEMCACHE_FEED_KEY % user_id)
+        if entries is None:
+            feed = ConferenceApi._feedKey(user_id).get() or ConferenceApi._buildFeed(user_id)
+            entries = feed.entries
+            memcache.add(MEMCACHE_FEED_KEY % user_id, entries)
+        return ConferenceForms(
+            items=[protojson.decode_message(ConferenceForm, data) for websafeKey, data in entries[field]]
+        )
+
+    @staticmethod
+    @ndb.transactional()
+    def _changeFeed(user_id, field, addEntries=(), removeKeys=()):
+        """Add or replace, and remove, entries of the 'created' or 'attending' list of a user's feed.
+        Feeds that have not been built are left alone; they are built on the next read."""
+        feed = ConferenceApi._feedKey(user_id).get()
+        if not feed:
+            return
+
+        drop = set(removeKeys) | set(websafeKey for websafeKey, data in addEntries)
+        entries = dict(feed.entries)
+        entries[field] = [entry for entry in entries[field] if entry[0] not in drop] + list(addEntries)
+        feed.entries = entries
+        feed.put()
+
+        ndb.get_context().call_on_commit(lambda: memcache.delete(MEMCACHE_FEED_KEY % user_id))
+
+    @staticmethod
+    def _dropFeed(user_id):
+        """Delete a user's feed so that it is rebuilt on the next read."""
+        ConferenceApi._feedKey(user_id).delete()
+        ndb.get_context().call_on_commit(lambda: memcache.delete(MEMCACHE_FEED_KEY % user_id))
+
+    @staticmethod
+    def _queueFeedRefresh(wsck):
+        """Queue the refresh of a conference in its attendees' feeds at the end of the current
+        FEED_SEATS_REFRESH_SECONDS window; the task is named after the window, so there is one per window."""
+        now = time.time()
+        window = int(now // FEED_SEATS_REFRESH_SECONDS)
+        try:
+            taskqueue.add(name='refresh-feeds-%s-%d' % (hashlib.md5(wsck).hexdigest(), window),
+                params={'websafeConferenceKey': wsck},
+                url='/tasks/refresh_feeds',
+                countdown=(window + 1) * FEED_SEATS_REFRESH_SECONDS - now
+            )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+    @staticmethod
+    def _organizerRenamed(user_id):
+        """Refresh the organiser name of a user's conferences in the feeds & query results once the current
+        transaction commits: the user's own feed is rebuilt, the attendees' feeds are refreshed by tasks."""
+        ConferenceApi._dropFeed(user_id)
+        tasks = TaskBuffer()
+        for confKey in Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch(keys_only=True):
+            tasks.add(params={'websafeConferenceKey': confKey.urlsafe()}, url='/tasks/refresh_feeds')
+        ctx = ndb.get_context()
+        ctx.call_on_commit(tasks.flush)
+        ctx.call_on_commit(ConferenceApi._bumpQueryGeneration)
+
+    @staticmethod
+    def _refreshFeeds(wsck, websafeCursor=None, legacy=False):
+        """Refresh a conference in the feeds of its organiser and attendees, a batch at a time; used by the
+        refresh feeds task after a conference update. Profiles still on the legacy key list go last."""
+        confKey = ndb.Key(urlsafe=wsck)
+        conf = confKey.get()
+        if not conf:
+            return
+        entries = ConferenceApi._renderFeedEntries([conf])
+        if not websafeCursor and not legacy:
+            ConferenceApi._changeFeed(confKey.parent().id(), 'created', entries)
+
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        if legacy:
+            query = Profile.query(Profile.conferenceKeysToAttend == wsck)
+        else:
+            query = Profile.query(Profile.conferencesToAttend == confKey)
+        profKeys, nextCursor, more = query.fetch_page(FEED_REFRESH_BATCH, keys_only=True, start_cursor=cursor)
+        for profKey in profKeys:
+            ConferenceApi._changeFeed(profKey.id(), 'attending', entries)
+
+        params = {'websafeConferenceKey': wsck}
+        if more and nextCursor:
+            params.update(cursor=nextCursor.urlsafe(), legacy=legacy and '1' or '')
+        elif not legacy:
+            params.update(legacy='1')
+        else:
+            return
+        taskqueue.add(params=params, url='/tasks/refresh_feeds')
+
+# - - - Recommendations - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _recommendationPartition(key):
+        """Return the recommendation job partition a session key belongs to."""
+        return (zlib.crc32(key.urlsafe()) & 0xffffffff) % RECOMMENDATION_PARTITIONS
+
+    @staticmethod
+    def _startRecommendations():
+        """Start a recommendation run with a single scan of the wishlists; used by the recommendations cron job."""
+        run = int(time.time())
+        RecommendationState(id=1, run=run).put()
+        taskqueue.add(params={'run': run, 'seq': 0}, url='/tasks/recommendations')
+
+    @staticmethod
+    def _cooccurrenceKey(sessionKey):
+        """Return the key of the SessionCooccurrence of a session."""
+        return ndb.Key(SessionCooccurrence, 1, parent=sessionKey)
+
+    @staticmethod
+    def _mergeCooccurrences(run, seq, scores):
+        """Add {source session key: {target session key: count}} to the stored counts of the run, keeping the
+        RECOMMENDATION_CANDIDATES most frequent targets of each source. Sources that already merged the counts
+        of counting task seq are skipped, so a retried task does not count its profiles twice."""
+        sources = scores.keys()
+        for i in range(0, len(sources), RECOMMENDATION_BATCH_SIZE):
+            batch = sources[i:i + RECOMMENDATION_BATCH_SIZE]
+            stored = ndb.get_multi([ConferenceApi._cooccurrenceKey(source) for source in batch])
+            merged = []
+            for source, entity in zip(batch, stored):
+                counts = scores[source]
+                if entity and entity.run == run:
+                    if entity.seq > seq:
+                        continue
+                    for target, count in zip(entity.targets, entity.counts):
+                        counts[target] = counts.get(target, 0) + count
+                best = heapq.nlargest(RECOMMENDATION_CANDIDATES, counts.items(), key=lambda item: item[1])
+                merged.append(SessionCooccurrence(
+                    key=ConferenceApi._cooccurrenceKey(source),
+                    targets=[target for target, count in best],
+                    counts=[count for target, count in best],
+                    run=run,
+                    seq=seq + 1
+                ))
+            ndb.put_multi(merged)
+
+    @staticmethod
+    def _computeRecommendations(run, seq):
+        """Count wishlist co-occurrence of all sessions, scanning profiles from the checkpoint of the run for
+        RECOMMENDATION_TASK_SECONDS. The counts are merged into each source's SessionCooccurrence, then the
+        checkpoint is advanced and the next task queued in one transaction; the task after the last profile
+        queues the scoring of the sessions, one task per partition."""
+        run, seq = int(run), int(seq)
+        stateKey = ndb.Key(RecommendationState, 1)
+        state = stateKey.get()
+        # a retried task whose checkpoint was already saved no longer owns the scan
+        if not state or state.run != run or state.seq != seq:
+            return
+        if state.counted:
+            # more tasks than a transaction may enqueue; queueing a partition twice only scores it twice
+            tasks = TaskBuffer()
+            for partition in range(RECOMMENDATION_PARTITIONS):
+                tasks.add(params={'run': run, 'partition': partition}, url='/tasks/recommendations_score')
+            tasks.flush()
+            return
+
+        scores = {}
+        cursor = ndb.Cursor(urlsafe=state.cursor) if state.cursor else None
+        deadline = time.time() + RECOMMENDATION_TASK_SECONDS
+        more = True
+        while more and time.time() < deadline:
+            profs, cursor, more = Profile.query().fetch_page(RECOMMENDATION_BATCH_SIZE, start_cursor=cursor)
+            for prof in profs:
+                ConferenceApi._upgradeProfile(prof)
+                for source in prof.wishlist:
+                    counts = scores.setdefault(source, {})
+                    for target in prof.wishlist:
+                        if target != source:
+                            counts[target] = counts.get(target, 0) + 1
+            more = more and cursor
+        ConferenceApi._mergeCooccurrences(run, seq, scores)
+
+        @ndb.transactional()
+        def save():
+            stored = stateKey.get()
+            if not stored or stored.run != run or stored.seq != seq:
+                return
+            stored.seq += 1
+            stored.cursor = cursor.urlsafe() if more else None
+            stored.counted = not more
+            stored.put()
+            taskqueue.add(params={'run': run, 'seq': stored.seq},
+                url='/tasks/recommendations', transactional=True)
+        save()
+
+    @staticmethod
+    def _scoreRecommendations(run, partition, websafeCursor=None):
+        """Store the SessionNeighbours of the sessions in one partition, walking session keys from websafeCursor
+        for RECOMMENDATION_TASK_SECONDS and then chaining another task. Only the partition's sessions, their
+        co-occurrence counts, the sessions sharing their speakers and their candidate targets are loaded."""
+        run, partition = int(run), int(partition)
+
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        deadline = time.time() + RECOMMENDATION_TASK_SECONDS
+        more = True
+        while more and time.time() < deadline:
+            keys, cursor, more = Session.query().fetch_page(
+                RECOMMENDATION_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+            more = more and cursor
+            sources = [session for session in ndb.get_multi(
+                [key for key in keys if ConferenceApi._recommendationPartition(key) == partition]) if session]
+            if not sources:
+                continue
+            for session in sources:
+                ConferenceApi._upgradeSession(session)
+
+            # shared speakers, one keys-only query per speaker
+            speakerKeys = set(speakerKey for session in sources for speakerKey in session.speakers)
+            futures = dict((speakerKey, Session.query(Session.speakers == speakerKey).fetch_async(keys_only=True))
+                           for speakerKey in speakerKeys)
+            bySpeaker = dict((speakerKey, future.get_result()) for speakerKey, future in futures.items())
+
+            allCounts = {}
+            cooccurrences = ndb.get_multi([ConferenceApi._cooccurrenceKey(session.key) for session in sources])
+            for session, cooccurrence in zip(sources, cooccurrences):
+                counts = {}
+                if cooccurrence and cooccurrence.run == run:
+                    counts = dict((target, float(count))
+                                  for target, count in zip(cooccurrence.targets, cooccurrence.counts))
+                for speakerKey in session.speakers:
+                    for target in bySpeaker[speakerKey]:
+                        if target != session.key:
+                            counts[target] = counts.get(target, 0.0) + RECOMMENDATION_SPEAKER_WEIGHT
+                allCounts[session.key] = counts
+
+            # same type within the same conference, for the candidates that still exist
+            candidates = list(set(target for counts in allCounts.values() for target in counts))
+            targets = {}
+            for target in ndb.get_multi(candidates):
+                if target:
+                    ConferenceApi._upgradeSession(target)
+                    targets[target.key] = target
+
+            neighbours = []
+            for session in sources:
+                counts = allCounts[session.key]
+                for target in counts:
+                    if target in targets and target.parent() == session.key.parent() \
+                            and targets[target].typeCode == session.typeCode:
+                        counts[target] += RECOMMENDATION_TYPE_WEIGHT
+                best = heapq.nlargest(RECOMMENDATION_NEIGHBOURS,
+                                      ((score, target) for target, score in counts.items() if target in targets))
+                neighbours.append(SessionNeighbours(
+                    id=1,
+                    parent=session.key,
+                    neighbours=[target for score, target in best],
+                    scores=[score for score, target in best]
+                ))
+            ndb.put_multi(neighbours)
+
+        if more:
+            taskqueue.add(params={'run': run, 'partition': partition, 'cursor': cursor.urlsafe()},
+                url='/tasks/recommendations_score')
+        else:
+            logging.info('Computed recommendations for partition %d' % partition)
+
+    @endpoints.method(SESSION_GET_RECOMMENDED_REQUEST, SessionForms,
+            path='recommendedSessions',
+            http_method='GET', name='getRecommendedSessions')
+    def getRecommendedSessions(self, request):
+        """Return sessions recommended for a session, or for the user's wishlist if no session is given"""
+        if request.websafeSessionKey:
+            sessionKey, session = ConferenceApi._getKeyAndEntityFromWebsafeKeyOfType(request.websafeSessionKey, Session)
+            sources = [sessionKey]
+            exclude = set(sources)
+        else:
+            user_id = self._getUserId()
+            user = ndb.Key(Profile, user_id).get()
+            ConferenceApi._upgradeProfile(user)
+            sources = user.wishlist
+            exclude = set(sources)
+
+        # one keyed read of the precomputed neighbour lists, merged by score
+        merged = {}
+        for entity in ndb.get_multi([ndb.Key(SessionNeighbours, 1, parent=source) for source in sources]):
+            if entity:
+                for target, score in zip(entity.neighbours, entity.scores):
+                    if target not in exclude:
+                        merged[target] = merged.get(target, 0.0) + score
+        best = heapq.nlargest(RECOMMENDATION_NEIGHBOURS, merged.items(), key=lambda item: item[1])
+
+        # then one batch get of the recommended sessions
+        return self._copySessionsToForms(
+            [session for session in ndb.get_multi([target for target, score in best]) if session])
+
+# - - - Warmup - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _warmup():
+        """Prime a new instance and memcache before it takes traffic; used by the warmup request.
+        Steps run in order until WARMUP_SECONDS are used up; returns {step: seconds taken}."""
+        timings = {}
+        if not WARMUP_ENABLED:
+            return timings
+        started = time.time()
+        deadline = started + WARMUP_SECONDS
+        api = ConferenceApi()
+        for step in (ConferenceApi._warmMessages, ConferenceApi._warmAnnouncement, api._warmConferences):
+            if time.time() >= deadline:
+                logging.warning('Warmup out of time before %s' % step.__name__)
+                break
+            stepStarted = time.time()
+            try:
+                step()
+            except Exception:
+                logging.exception('Warmup step %s failed' % step.__name__)
+            timings[step.__name__] = round(time.time() - stepStarted, 3)
+        logging.info('Warmup took %.3fs: %s' % (time.time() - started, timings))
+        return timings
+
+    @staticmethod
+    def _localCacheStats():
+        """Return the size, hits & misses of every in-process cache of this instance."""
+        return dict((kind.__name__, cache.stats()) for kind, cache in LOCAL_CACHES.items())
+
+    @staticmethod
+    def _warmMessages():
+        """Resolve the field tables of all message classes by encoding & decoding each once."""
+        for cls in vars(models).values():
+            if isinstance(cls, type) and issubclass(cls, messages.Message) and cls is not messages.Message:
+                try:
+                    protojson.decode_message(cls, protojson.encode_message(cls()))
+                except messages.ValidationError:
+                    pass
+
+    @staticmethod
+    def _warmAnnouncement():
+        """Build the announcement unless it is already in memcache."""
+        if memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) is None:
+            ConferenceApi._cacheAnnouncement()
+
+    def _warmConferences(self):
+        """Cache the forms, sessions & featured speakers of the next WARMUP_CONFERENCES upcoming conferences."""
+        today = date.today()
+        forms = self._getConferencesInWindow(
+            today, today + timedelta(days=CALENDAR_UPCOMING_DAYS)).items[:WARMUP_CONFERENCES]
+        confKeys = [ndb.Key(urlsafe=cf.websafeKey) for cf in forms]
+        sessionFutures = [Session.query(ancestor=confKey).fetch_async() for confKey in confKeys]
+
+        setCoalesced(dict((MEMCACHE_COALESCE_KEY % ('getConference', cf.websafeKey), protojson.encode_message(cf))
+                          for cf in forms), **COALESCE_SETTINGS['getConference'])
+        setCoalesced(dict((MEMCACHE_COALESCE_KEY % ('getConferenceSessions', cf.websafeKey),
+                           protojson.encode_message(self._copySessionsToForms(future.get_result())))
+                          for cf, future in zip(forms, sessionFutures)), **COALESCE_SETTINGS['getConferenceSessions'])
+
+        ConferenceApi._getFeaturedRankings([cf.websafeKey for cf in forms])
+
+# - - - Mapper jobs - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _mapperKeyRanges(model, shards):
+        """Split the key space of a kind into at most shards (start, end) ranges of similar size,
+        using the __scatter__ sample of its keys."""
+        keys = model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+            shards * MAPPER_OVERSAMPLING, keys_only=True)
+        keys.sort()
+        splits = sorted(set(keys[len(keys) * i // shards] for i in range(1, shards))) if keys else []
+        bounds = [None] + splits + [None]
+        return zip(bounds[:-1], bounds[1:])
+
+    @staticmethod
+    def _startMapper(name):
+        """Create a MapperJob for one of MAPPER_JOBS and queue a task per key range; used by the mapper cron jobs."""
+        if name not in MAPPER_JOBS:
+            raise ValueError('Unknown mapper job: %s' % name)
+        model = ndb.Model._lookup_model(MAPPER_JOBS[name][0])
+        ranges = ConferenceApi._mapperKeyRanges(model, MAPPER_SHARDS)
+
+        jobKey = MapperJob(name=name, shards=len(ranges)).put()
+        shards = [MapperShard(id=i + 1, parent=jobKey, start=start, end=end)
+                  for i, (start, end) in enumerate(ranges)]
+        ndb.put_multi(shards)
+
+        tasks = TaskBuffer()
+        for shard in shards:
+            tasks.add(params={'jobId': jobKey.id(), 'shard': shard.key.id(), 'seq': 0}, url='/tasks/mapper')
+        tasks.flush()
+        logging.info('Started mapper job %s (%d) with %d shards' % (name, jobKey.id(), len(shards)))
+        return jobKey
+
+    @staticmethod
+    def _runMapperShard(jobId, shardId, seq):
+        """Map batches of a shard's key range from its checkpoint for MAPPER_TASK_SECONDS, or until the task has
+        changed MAPPER_TASK_COUNTERS counters, then chain another task.
+        The map function gets each batch of entities with the task's counters, may add to the counters and
+        returns the entities to put. The shard is only written by the checkpoint at the end of the task, so
+        a job's shards, which share its entity group, write it once per task rather than once per batch.
+        Counters are added to the job's MapperCounters by the checkpoint, so they count every entity once;
+        puts must be idempotent as the task's batches are mapped again if it dies before the checkpoint."""
+        jobKey = ndb.Key(MapperJob, int(jobId))
+        shardKey = ndb.Key(MapperShard, int(shardId), parent=jobKey)
+        job, shard = ndb.get_multi([jobKey, shardKey])
+        # a retried task whose successor was already queued no longer owns the shard
+        if not job or not shard or shard.done or shard.seq != int(seq):
+            return
+
+        kind, mapName, finishName = MAPPER_JOBS[job.name]
+        model = ndb.Model._lookup_model(kind)
+        mapFunction = getattr(ConferenceApi, mapName)
+        query = model.query()
+        if shard.start:
+            query = query.filter(model.key >= shard.start)
+        if shard.end:
+            query = query.filter(model.key < shard.end)
+        query = query.order(model.key)
+        deadline = time.time() + MAPPER_TASK_SECONDS
+
+        counters = {}
+        while not shard.done and time.time() < deadline and len(counters) < MAPPER_TASK_COUNTERS:
+            cursor = ndb.Cursor(urlsafe=shard.cursor) if shard.cursor else None
+            keys, nextCursor, more = query.fetch_page(MAPPER_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+            entities = [entity for entity in ndb.get_multi(keys) if entity]
+
+            toPut = mapFunction(entities, counters)
+            if toPut:
+                ndb.put_multi(toPut)
+
+            shard.processed += len(entities)
+            shard.cursor = nextCursor.urlsafe() if nextCursor else None
+            shard.done = not (more and nextCursor)
+
+        ConferenceApi._checkpointMapperShard(shard, counters, finishName)
+
+    @staticmethod
+    @ndb.transactional()
+    def _checkpointMapperShard(shard, counters, finishName):
+        """Save the checkpoint of a shard at the end of its task, adding the task's counters to the job's
+        MapperCounters, and hand the shard to the next task, or mark it done, queueing the job's finish
+        function once all shards are. The checkpoint only writes the counters the task changed, so its size
+        does not grow with the job. A task retried after its checkpoint committed finds the stored shard
+        moved on and does nothing."""
+        jobKey = shard.key.parent()
+        stored = shard.key.get()
+        if not stored or stored.done or stored.seq != shard.seq:
+            return
+        counterKeys = [ndb.Key(MapperCounter, name, parent=jobKey) for name in counters]
+        ndb.put_multi([MapperCounter(key=key, count=(counter.count if counter else 0) + counters[key.id()])
+                       for key, counter in zip(counterKeys, ndb.get_multi(counterKeys))])
+        if shard.done:
+            job = jobKey.get()
+            # count the done shards rather than incrementing, so the count can't run ahead of them
+            shardKeys = [ndb.Key(MapperShard, i + 1, parent=jobKey) for i in range(job.shards)]
+            others = [s for s in ndb.get_multi(shardKeys) if s and s.key != shard.key]
+            job.shardsDone = 1 + sum(1 for s in others if s.done)
+            if job.shardsDone == job.shards:
+                if finishName:
+                    taskqueue.add(params={'jobId': jobKey.id()}, url='/tasks/mapper_finish', transactional=True)
+                else:
+                    job.finished = datetime.utcnow()
+            ndb.put_multi([job, shard])
+        else:
+            shard.seq += 1
+            shard.put()
+            taskqueue.add(params={'jobId': jobKey.id(), 'shard': shard.key.id(), 'seq': shard.seq},
+                url='/tasks/mapper', transactional=True)
+
+    @staticmethod
+    def _finishMapper(jobId, websafeCursor=None):
+        """Run the finish function of a job a page at a time, chaining a task per page like the map tasks do.
+        The finish function gets the results so far and the cursor of its page, reads the job's MapperCounters
+        it needs for the page, and returns the results with the cursor of the next page, or None when done."""
+        jobKey = ndb.Key(MapperJob, int(jobId))
+        job = jobKey.get()
+        # a retried task whose successor was already queued no longer owns the page
+        if not job or job.finished or job.finishCursor != (websafeCursor or None):
+            return
+        finishFunction = getattr(ConferenceApi, MAPPER_JOBS[job.name][2])
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        results, nextCursor = finishFunction(job, job.results, cursor)
+        ConferenceApi._checkpointMapperFinish(jobKey, websafeCursor or None, results, nextCursor)
+
+    @staticmethod
+    @ndb.transactional()
+    def _checkpointMapperFinish(jobKey, websafeCursor, results, nextCursor):
+        """Save the results of a page of a job's finish function and queue the next page, or mark the job
+        finished. A task retried after its checkpoint committed finds the job moved on and does nothing."""
+        job = jobKey.get()
+        if not job or job.finished or job.finishCursor != websafeCursor:
+            return
+        job.results = results
+        if nextCursor:
+            job.finishCursor = nextCursor.urlsafe()
+            taskqueue.add(params={'jobId': jobKey.id(), 'cursor': job.finishCursor},
+                url='/tasks/mapper_finish', transactional=True)
+        else:
+            job.finishCursor = None
+            job.finished = datetime.utcnow()
+        job.put()
+
+    @staticmethod
+    def _mapperStatus(jobId):
+        """Return the progress and throughput of a mapper job as a dict, or None if there is no such job."""
+        jobKey = ndb.Key(MapperJob, int(jobId))
+        job = jobKey.get()
+        if not job:
+            return None
+        shards = MapperShard.query(ancestor=jobKey).fetch()
+        processed = sum(shard.processed for shard in shards)
+        seconds = ((job.finished or datetime.utcnow()) - job.started).total_seconds()
+        return {
+            'id': job.key.id(),
+            'name': job.name,
+            'started': job.started.isoformat(),
+            'finished': job.finished.isoformat() if job.finished else None,
+            'shards': job.shards,
+            'shardsDone': job.shardsDone,
+            'processed': processed,
+            'perSecond': round(processed / seconds, 1) if seconds else None,
+            'results': job.results,
+        }
+
+    @staticmethod
+    def _latestMapperJob(name):
+        """Return the id of the most recently started job of a mapper, or None if it never ran."""
+        jobKey = MapperJob.query(MapperJob.name == name).order(-MapperJob.started).get(keys_only=True)
+        return jobKey.id() if jobKey else None
+
+    @staticmethod
+    def _mapFeaturedSpeakers(confs, counters):
+        """Mapper job: recount the sessions of all speakers of a batch of conferences
+        and re-rank their featured speakers."""
+        futures = [(conf, Session.query(ancestor=conf.key).fetch_async()) for conf in confs]
+        for conf, future in futures:
+            sessionCounts, websafeSessionKeys = ConferenceApi._countSpeakerSessions(future.get_result())
+            name = 'featured' if ConferenceApi._storeFeaturedCounts(conf.key.urlsafe(), sessionCounts,
+                                                                   websafeSessionKeys) else 'unfeatured'
+            counters[name] = counters.get(name, 0) + 1
+
+    @staticmethod
+    def _mapSeatCounts(profiles, counters):
+        """Mapper job: count the attendees of every conference, keyed by websafe conference key."""
+        for prof in profiles:
+            ConferenceApi._upgradeProfile(prof)
+            for confKey in prof.conferencesToAttend:
+                wsck = confKey.urlsafe()
+                counters[wsck] = counters.get(wsck, 0) + 1
+
+    @staticmethod
+    def _countAttendees(confKey):
+        """Count the profiles attending a conference, including those still on the legacy key list."""
+        keys = Profile.query(Profile.conferencesToAttend == confKey).fetch_async(keys_only=True)
+        legacyKeys = Profile.query(Profile.conferenceKeysToAttend == confKey.urlsafe()).fetch_async(keys_only=True)
+        return len(set(keys.get_result()) | set(legacyKeys.get_result()))
+
+    @staticmethod
+    def _expectedSeats(confs, attendees):
+        """Return {conference key: seats that should be available} for a batch of conferences: maxAttendees
+        less the attendees. Seats parked in seat shards or held there still count as available."""
+        return dict((conf.key, (conf.maxAttendees or 0) - attendees(conf.key)) for conf in confs)
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _correctSeats(confKey, counted, seats):
+        """Set a conference's seats to what seat reconciliation recounted, in one transaction, provided they
+        are still the seats the recount was taken against; returns whether they were corrected."""
+        conf = confKey.get()
+        if not conf or (conf.seatsAvailable or 0) != counted:
+            return False
+        conf.seatsAvailable = seats
+        conf.put()
+        ConferenceApi._logChange(confKey, 'update')
+        ConferenceApi._seatsChanged(confKey)
+        return True
+
+    @staticmethod
+    def _reconcileSeatCounts(job, results, cursor):
+        """Finish the seat_counts mapper job, a page of conferences per task: compare every conference's
+        seatsAvailable with the attendee counts of the job and recount the ones that drifted. Seats found
+        too high are lowered; seats found too low are only reported, as a lagging count could oversell."""
+        results = results or {'checked': 0, 'drifted': 0, 'corrected': 0, 'findings': []}
+        deadline = time.time() + MAPPER_TASK_SECONDS
+        more = True
+        while more and time.time() < deadline:
+            confs, cursor, more = Conference.query().fetch_page(SEAT_RECONCILE_BATCH, start_cursor=cursor)
+            results['checked'] += len(confs)
+            counters = ndb.get_multi([ndb.Key(MapperCounter, conf.key.urlsafe(), parent=job.key) for conf in confs])
+            counts = dict((conf.key, counter.count if counter else 0) for conf, counter in zip(confs, counters))
+            expected = ConferenceApi._expectedSeats(confs, counts.get)
+            suspectKeys = [conf.key for conf in confs if (conf.seatsAvailable or 0) != expected[conf.key]]
+            if not suspectKeys:
+                continue
+
+            # profiles changed while the job ran, so confirm the drift with fresh seats and a fresh count;
+            # the correction is only applied if the seats are still those the count was taken against
+            suspects = [conf for conf in ndb.get_multi(suspectKeys, use_cache=False, use_memcache=False) if conf]
+            recounted = ConferenceApi._expectedSeats(suspects, ConferenceApi._countAttendees)
+            for conf in suspects:
+                counted = conf.seatsAvailable or 0
+                seats = recounted[conf.key]
+                if seats == counted:
+                    continue
+                results['drifted'] += 1
+                corrected = seats < counted and ConferenceApi._correctSeats(conf.key, counted, seats)
+                if corrected:
+                    results['corrected'] += 1
+                    logging.warning('Corrected seats of conference %s (%s) from %d to %d' % (
+                        conf.key.urlsafe(), conf.name, counted, seats))
+                else:
+                    logging.warning('Seats of conference %s (%s) are %d, recounted %d; left for review' % (
+                        conf.key.urlsafe(), conf.name, counted, seats))
+                if len(results['findings']) < SEAT_RECONCILE_MAX_FINDINGS:
+                    results['findings'].append({
+                        'websafeConferenceKey': conf.key.urlsafe(),
+                        'name': conf.name,
+                        'seatsAvailable': counted,
+                        'recounted': seats,
+                        'corrected': corrected,
+                        'oversold': seats < 0,
+                    })
+
+        if more and cursor:
+            return results, cursor
+        logging.info('Reconciled seats of %d conferences, %d had drifted, %d were corrected' % (
+            results['checked'], results['drifted'], results['corrected']))
+        return results, None
+
+# - - - Migrations - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateSession(sessionKey):
+        """Convert one Session to the compact schema from a fresh read in its own transaction, so a session
+        deleted since it was listed is not written back; return whether it changed."""
+        session = sessionKey.get()
+        if not session or not ConferenceApi._upgradeSession(session):
+            return False
+        session.put()
+        return True
+
+    @staticmethod
+    def _migrateSessions(websafeCursor=None):
+        """Convert one batch of Session entities to the compact schema and chain a task for the next
+        batch; used by the session migration cron job and its tasks."""
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        sessions, nextCursor, more = Session.query().fetch_page(
+            SESSION_MIGRATION_BATCH, start_cursor=cursor)
+
+        # the batch only picks the sessions to convert; each is converted from a fresh read
+        candidates = [session.key for session in sessions if ConferenceApi._upgradeSession(session)]
+        changed = sum(1 for sessionKey in candidates if ConferenceApi._migrateSession(sessionKey))
+        logging.info('Migrated %d of %d sessions' % (changed, len(sessions)))
+
+        if more and nextCursor:
+            taskqueue.add(params={'cursor': nextCursor.urlsafe()}, url='/tasks/migrate_sessions')
+
+    @staticmethod
+    def _mapUserIdentities(profiles, counters):
+        """Mapper job: map the email of each of a batch of profiles to its user id, to backfill the
+        identities of the custom user id mode. Existing mappings are kept; an email shared by profiles
+        is counted as a conflict and stays mapped to the first one."""
+        profiles = [prof for prof in profiles if prof.mainEmail]
+        identities = ndb.get_multi([ndb.Key(UserIdentity, prof.mainEmail.lower()) for prof in profiles])
+        for prof, identity in zip(profiles, identities):
+            if identity:
+                user_id = identity.userId
+            else:
+                user_id = claimUserId(prof.mainEmail, prof.key.id())
+                counters['created'] = counters.get('created', 0) + 1
+            if user_id != prof.key.id():
+                counters['conflicts'] = counters.get('conflicts', 0) + 1
+                logging.warning('Email of profile %s is mapped to user %s' % (prof.key.id(), user_id))
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateProfile(profKey):
+        """Convert one Profile to key lists from a fresh read in its own transaction, so registrations and
+        wishlist changes committed since it was listed are kept; return whether it changed."""
+        prof = profKey.get()
+        if not prof or not ConferenceApi._upgradeProfile(prof):
+            return False
+        prof.put()
+        return True
+
+    @staticmethod
+    def _migrateProfiles(websafeCursor=None):
+        """Convert one batch of Profile entities to key lists and chain a task for the next batch;
+        used by the profile migration cron job and its tasks."""
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        profiles, nextCursor, more = Profile.query().fetch_page(
+            PROFILE_MIGRATION_BATCH, start_cursor=cursor)
+
+        # the batch only picks the profiles to convert; each is converted from a fresh read
+        candidates = [prof.key for prof in profiles if ConferenceApi._upgradeProfile(prof)]
+        changed = sum(1 for profKey in candidates if ConferenceApi._migrateProfile(profKey))
+        logging.info('Migrated %d of %d profiles' % (changed, len(profiles)))
+
+        if more and nextCursor:
+            taskqueue.add(params={'cursor': nextCursor.urlsafe()}, url='/tasks/migrate_profiles')
+
+# - - - Export - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _exportKinds():
+        """Return the models exported by the nightly export, in export order."""
+        return [Conference, Session, Speaker, Profile]
+
+    @staticmethod
+    def _exportValue(value):
+        """JSON encoder fallback for datastore values (dates, times and keys)."""
+        if isinstance(value, ndb.Key):
+            return value.urlsafe()
+        return value.isoformat()
+
+    @staticmethod
+    def _startExport():
+        """Create a new ExportJob and queue its first task; used by the export cron job."""
+        jobKey = ExportJob().put()
+        taskqueue.add(params={'jobId': jobKey.id()}, url='/tasks/export')
+        return jobKey
+
+    @staticmethod
+    def _runExport(jobId):
+        """Export batches of the job from its checkpoint for EXPORT_TASK_SECONDS, then chain another task.
+        Every batch is written together with the advanced checkpoint, so a restarted task resumes where
+        the previous one stopped without writing a chunk twice."""
+        jobKey = ndb.Key(ExportJob, int(jobId))
+        kinds = ConferenceApi._exportKinds()
+        deadline = time.time() + EXPORT_TASK_SECONDS
+
+        job = jobKey.get()
+        while job and not job.done and time.time() < deadline:
+            model = kinds[job.kindIndex]
+            cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+
+            # walk keys only, then fetch the batch in one get_multi
+            keys, nextCursor, more = model.query().fetch_page(
+                EXPORT_BATCH_SIZE, keys_only=True, start_cursor=cursor)
+            rows = []
+            for entity in ndb.get_multi(keys):
+                if entity:
+                    row = entity.to_dict(exclude=EXPORT_EXCLUDED.get(model.__name__))
+                    row['_kind'] = model.__name__
+                    row['_key'] = entity.key.urlsafe()
+                    rows.append(json.dumps(row, default=ConferenceApi._exportValue))
+            job = ConferenceApi._writeExportChunk(jobKey, job.kindIndex, job.cursor, rows,
+                nextCursor.urlsafe() if more and nextCursor else None)
+
+        if job and not job.done:
+            taskqueue.add(params={'jobId': jobId}, url='/tasks/export')
+        elif job:
+            logging.info('Export %s finished: %d rows in %d chunks' % (jobId, job.rows, job.chunks))
+
+    @staticmethod
+    @ndb.transactional()
+    def _writeExportChunk(jobKey, kindIndex, cursor, rows, nextCursor):
+        """Store one chunk and advance the checkpoint of the job, returning the updated job."""
+        job = jobKey.get()
+        if job.done or job.kindIndex != kindIndex or job.cursor != cursor:
+            # another task already wrote this batch
+            return job
+
+        if rows:
+            ExportChunk(
+                id='%02d-%08d' % (kindIndex, job.chunks),
+                parent=jobKey,
+                kind=ConferenceApi._exportKinds()[kindIndex].__name__,
+                rows=len(rows),
+                data='\n'.join(rows) + '\n'
+            ).put()
+            job.chunks += 1
+            job.rows += len(rows)
+
+        if nextCursor:
+            job.cursor = nextCursor
+        else:
+            job.kindIndex += 1
+            job.cursor = None
+            job.done = job.kindIndex >= len(ConferenceApi._exportKinds())
+        job.put()
+        return job
+
+    @staticmethod
+    def _getExportPart(jobId, websafeCursor=None):
+        """Return the newline-delimited JSON data of up to EXPORT_DOWNLOAD_CHUNKS chunks of a finished export
+        from websafeCursor, in export order, and the cursor of the next part (None after the last part).
+        Return None when there is no such export, or it has expired."""
+        job = ndb.Key(ExportJob, int(jobId)).get()
+        cutoff = datetime.utcnow() - timedelta(days=EXPORT_RETENTION_DAYS)
+        if not job or not job.done or job.created < cutoff:
+            return None
+        try:
+            cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        except datastore_errors.BadValueError:
+            return None
+
+        chunks, nextCursor, more = ExportChunk.query(ancestor=job.key).order(ExportChunk.key).fetch_page(
+            EXPORT_DOWNLOAD_CHUNKS, start_cursor=cursor)
+        return ''.join(chunk.data for chunk in chunks), nextCursor.urlsafe() if more and nextCursor else None
+
+    @staticmethod
+    def _pruneExports():
+        """Delete export jobs older than EXPORT_RETENTION_DAYS, chunks first since they hold profile emails;
+        used by the export cleanup cron job. Chains a task when EXPORT_TASK_SECONDS run out."""
+        cutoff = datetime.utcnow() - timedelta(days=EXPORT_RETENTION_DAYS)
+        deadline = time.time() + EXPORT_TASK_SECONDS
+        for jobKey in ExportJob.query(ExportJob.created < cutoff).fetch(keys_only=True):
+            # the job is deleted last, so an interrupted run finds its remaining chunks again
+            while True:
+                if time.time() > deadline:
+                    taskqueue.add(url='/tasks/prune_exports')
+                    return
+                keys = ExportChunk.query(ancestor=jobKey).fetch(DELETE_BATCH_SIZE, keys_only=True)
+                if not keys:
+                    break
+                ndb.delete_multi(keys)
+            jobKey.delete()
+
+
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -12,11 +12,21 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+from datetime import datetime
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from conference import ConferenceApi
 
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Prime caches before the instance takes traffic."""
+        ConferenceApi._warmup()
+        self.response.set_status(200)
+
+
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
@@ -24,6 +34,236 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class RecomputeFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild conference facet counters from scratch."""
+        ConferenceApi._recomputeFacetCounts()
+        self.response.set_status(204)
+
+
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a nightly export of conferences, sessions, speakers & profiles."""
+        ConferenceApi._startExport()
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next batches of an export job."""
+        ConferenceApi._runExport(self.request.get('jobId'))
+        self.response.set_status(204)
+
+
+class ExportDownloadHandler(webapp2.RequestHandler):
+    def get(self, jobId):
+        """Return one part of the newline-delimited JSON of an export job; the Link header points to the next."""
+        part = ConferenceApi._getExportPart(jobId, self.request.get('cursor'))
+        if part is None:
+            self.abort(404)
+        data, nextCursor = part
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+        if nextCursor:
+            self.response.headers['Link'] = '<%s?cursor=%s>; rel="next"' % (self.request.path_url, nextCursor)
+        self.response.write(data)
+
+
+class PruneExportsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete expired exports."""
+        ConferenceApi._pruneExports()
+        self.response.set_status(204)
+
+    def post(self):
+        """Continue deleting expired exports."""
+        ConferenceApi._pruneExports()
+        self.response.set_status(204)
+
+
+class SweepSeatHoldsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Reclaim the seats of expired seat holds."""
+        ConferenceApi._sweepSeatHolds()
+        self.response.set_status(204)
+
+
+class MigrateSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start converting sessions to the compact schema."""
+        ConferenceApi._migrateSessions()
+        self.response.set_status(204)
+
+    def post(self):
+        """Convert the next batch of sessions to the compact schema."""
+        ConferenceApi._migrateSessions(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class MigrateProfilesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start converting profiles to key lists."""
+        ConferenceApi._migrateProfiles()
+        self.response.set_status(204)
+
+    def post(self):
+        """Convert the next batch of profiles to key lists."""
+        ConferenceApi._migrateProfiles(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class StartRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing session recommendations."""
+        ConferenceApi._startRecommendations()
+        self.response.set_status(204)
+
+
+class RecommendationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Count wishlist co-occurrence for the next profiles of a recommendation run."""
+        ConferenceApi._computeRecommendations(self.request.get('run'), self.request.get('seq'))
+        self.response.set_status(204)
+
+
+class ScoreRecommendationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Store the session recommendations of one partition."""
+        ConferenceApi._scoreRecommendations(self.request.get('run'), self.request.get('partition'),
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class RefreshFeedsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Refresh an updated conference in its attendees' feeds."""
+        ConferenceApi._refreshFeeds(self.request.get('websafeConferenceKey'),
+            self.request.get('cursor'), bool(self.request.get('legacy')))
+        self.response.set_status(204)
+
+
+class UpdateSpeakerStatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add a new session to the stats of its speakers."""
+        ConferenceApi._updateSpeakerStats(self.request.get('websafeSessionKey'))
+        self.response.set_status(204)
+
+
+class IndexSessionHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add a new session to the upcoming sessions index."""
+        ConferenceApi._indexSession(self.request.get('websafeSessionKey'))
+        self.response.set_status(204)
+
+
+class PruneSessionIndexHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete session index buckets of past hours."""
+        ConferenceApi._pruneSessionIndex()
+        self.response.set_status(204)
+
+
+class PruneChangeLogHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete old change log entries."""
+        ConferenceApi._pruneChangeLog()
+        self.response.set_status(204)
+
+
+class StartMapperHandler(webapp2.RequestHandler):
+    def get(self, name):
+        """Start a mapper job."""
+        try:
+            jobKey = ConferenceApi._startMapper(name)
+        except ValueError:
+            self.abort(404)
+        self.response.write('%d' % jobKey.id())
+
+
+class MapperHandler(webapp2.RequestHandler):
+    def post(self):
+        """Map the next batches of a mapper job shard."""
+        ConferenceApi._runMapperShard(self.request.get('jobId'),
+            self.request.get('shard'), self.request.get('seq'))
+        self.response.set_status(204)
+
+
+class FinishMapperHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run a page of the finish function of a mapper job whose shards are all done."""
+        ConferenceApi._finishMapper(self.request.get('jobId'), self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class MapperStatusHandler(webapp2.RequestHandler):
+    def get(self, jobId):
+        """Return the progress and results of a mapper job as JSON, given its id or
+        the name of a mapper for its latest job."""
+        if not jobId.isdigit():
+            jobId = ConferenceApi._latestMapperJob(jobId)
+        status = jobId and ConferenceApi._mapperStatus(jobId)
+        if not status:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status))
+
+
+class LocalCacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the in-process cache counters of this instance as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(ConferenceApi._localCacheStats()))
+
+
+class DeleteConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Delete the sessions & shards of a deleted conference."""
+        ConferenceApi._deleteConferenceData(self.request.get('websafeConferenceKey'),
+            self.request.get('cursor') or None, self.request.get('shard') or None)
+        self.response.set_status(204)
+
+
+class ReleaseAttendeesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Unregister & notify the attendees of a deleted conference."""
+        ConferenceApi._releaseAttendees(self.request.get('websafeConferenceKey'),
+            self.request.get('conferenceName'), self.request.get('cursor'),
+            bool(self.request.get('legacy')))
+        self.response.set_status(204)
+
+
+class RecomputeFeaturedSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recompute the featured speaker of a conference."""
+        ConferenceApi._recomputeFeaturedSpeaker(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class CalendarHandler(webapp2.RequestHandler):
+    def get(self, feedType, feedKey):
+        """Return a wishlist or conference agenda as an iCalendar feed."""
+        version = ConferenceApi._calendarVersion('%s_%s' % (feedType, feedKey))
+        self.response.etag = str(version)
+        self.response.last_modified = datetime.utcfromtimestamp(version // 1000)
+        self.response.cache_control = 'private, no-cache'
+
+        # unchanged feeds are answered from the version stamp alone
+        if self.request.if_none_match:
+            if str(version) in self.request.if_none_match:
+                self.response.status = 304
+                return
+        elif self.request.if_modified_since and \
+                self.request.if_modified_since.replace(tzinfo=None) >= self.response.last_modified.replace(tzinfo=None):
+            self.response.status = 304
+            return
+
+        calendar = ConferenceApi._calendarSessions(feedType, feedKey)
+        if not calendar:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        for chunk in ConferenceApi._iterCalendar(*calendar):
+            self.response.write(chunk)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
@@ -37,21 +277,108 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class FlushProfileHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write coalesced profile edits to the datastore."""
+        ConferenceApi._flushProfileChanges(self.request.get('userId'), self.request.get('changes'))
+        self.response.set_status(204)
+
+class SendWaitlistEmailHandler(webapp2.RequestHandler):
+    def post(self):
+        """Send email confirming registration from the waitlist."""
+        mail.send_mail(
+            'noreply@%s.appspotmail.com' % (
+                app_identity.get_application_id()),     # from
+            self.request.get('email'),                  # to
+            'A seat has opened up for you!',            # subj
+            'Hi, you have been moved off the waitlist and are '    # body
+            'now registered for the following conference:\r\n\r\n%s' % self.request.get(
+                'conferenceName')
+        )
+
+
+class SendCancellationEmailHandler(webapp2.RequestHandler):
+    def post(self):
+        """Send email telling an attendee a conference was cancelled."""
+        mail.send_mail(
+            'noreply@%s.appspotmail.com' % (
+                app_identity.get_application_id()),     # from
+            self.request.get('email'),                  # to
+            'A conference you registered for was cancelled',    # subj
+            'Hi, the following conference has been cancelled by its '   # body
+            'organiser and your registration was removed:\r\n\r\n%s' % self.request.get(
+                'conferenceName')
+        )
+
+
+class SettleGroupReservationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Give back the unused seats of a group registration whose request did not finish."""
+        ConferenceApi._settleAbandonedGroupReservation(self.request.get('websafeReservationKey'))
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Hand free seats of a conference to users on its waitlist."""
+        ConferenceApi._promoteFromWaitlist(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
 # ============================================
 # MY TASK 4 ADDITIONS ========================
 
 class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Updates featured speaker in memcache if necessary"""
-        ConferenceApi._updateFeaturedSpeaker(self.request.get('websafeConferenceKey'), self.request.get('websafeSpeakerKeys'))
+        if not self.request.get('websafeSessionKey'):
+            # queued before sessions were counted one at a time
+            ConferenceApi._recomputeFeaturedSpeaker(self.request.get('websafeConferenceKey'))
+        else:
+            ConferenceApi._updateFeaturedSpeaker(self.request.get('websafeConferenceKey'),
+                self.request.get('websafeSessionKey'), self.request.get('websafeSpeakerKeys'),
+                not self.request.get('remove'))
         self.response.set_status(204)
 
 # END OF MY TASK 4 ADDITIONS =================
 # ============================================
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/recompute_facets', RecomputeFacetsHandler),
+    ('/crons/export', StartExportHandler),
+    ('/crons/sweep_seat_holds', SweepSeatHoldsHandler),
+    ('/crons/migrate_sessions', MigrateSessionsHandler),
+    ('/tasks/migrate_sessions', MigrateSessionsHandler),
+    ('/crons/migrate_profiles', MigrateProfilesHandler),
+    ('/tasks/migrate_profiles', MigrateProfilesHandler),
+    ('/crons/recommendations', StartRecommendationsHandler),
+    ('/crons/prune_changes', PruneChangeLogHandler),
+    ('/crons/prune_session_index', PruneSessionIndexHandler),
+    (r'/crons/mappers/(\w+)', StartMapperHandler),
+    ('/tasks/mapper', MapperHandler),
+    ('/tasks/mapper_finish', FinishMapperHandler),
+    (r'/admin/mappers/(\w+)', MapperStatusHandler),
+    ('/admin/local_caches', LocalCacheStatsHandler),
+    ('/tasks/recommendations', RecommendationsHandler),
+    ('/tasks/recommendations_score', ScoreRecommendationsHandler),
+    ('/tasks/export', ExportHandler),
+    (r'/exports/(\d+)', ExportDownloadHandler),
+    ('/crons/prune_exports', PruneExportsHandler),
+    ('/tasks/prune_exports', PruneExportsHandler),
+    (r'/ical/(wishlist|conference)/([\w-]+)', CalendarHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/flush_profile', FlushProfileHandler),
+    ('/tasks/send_waitlist_email', SendWaitlistEmailHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/settle_group_reservation', SettleGroupReservationHandler),
+    ('/tasks/refresh_feeds', RefreshFeedsHandler),
+    ('/tasks/delete_conference', DeleteConferenceHandler),
+    ('/tasks/release_attendees', ReleaseAttendeesHandler),
+    ('/tasks/send_cancellation_email', SendCancellationEmailHandler),
+    ('/tasks/recompute_featured_speaker', RecomputeFeaturedSpeakerHandler),
+    ('/tasks/update_speaker_stats', UpdateSpeakerStatsHandler),
+    ('/tasks/index_session', IndexSessionHandler),
 
     # ============================================
     # MY TASK 4 ADDITIONS ========================
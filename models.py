@@ -21,22 +21,50 @@ class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- rate limit exception mapped to HTTP 503 response;
+    Endpoints v1 only passes a fixed set of status codes and returns other 4xx codes as 404"""
+    http_status = httplib.SERVICE_UNAVAILABLE
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferencesToAttend = ndb.KeyProperty(kind='Conference', repeated=True)
 
     # ============================================
     # MY TASK 2 ADDITIONS ========================
 
-    # list of Session for storing wishlist as a "has-a" relationship
-    sessions = ndb.StringProperty(repeated=True)
+    # list of Session keys for storing wishlist as a "has-a" relationship
+    wishlist = ndb.KeyProperty(kind='Session', repeated=True)
 
     # END OF MY TASK 2 ADDITIONS =================
     # ============================================
 
+    # secret of the user's wishlist calendar feed URL
+    calendarToken = ndb.StringProperty()
+
+    # {field: time of its latest edit written}, so write-behind flushes never apply an older edit
+    editTimes = ndb.PickleProperty()
+
+    # legacy websafe key lists, only read until the profile migration has converted every entity
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    sessions = ndb.StringProperty(repeated=True)
+
+class ConferenceFeed(ndb.Model):
+    """ConferenceFeed -- materialized "my conferences" dashboard of a user, child of Profile"""
+    entries         = ndb.PickleProperty(compressed=True)  # {'created'/'attending': [(websafeKey, ConferenceForm JSON)]}
+
+class CalendarToken(ndb.Model):
+    """CalendarToken -- profile of a wishlist calendar feed, token as id so feeds are found by key"""
+    profileKey      = ndb.KeyProperty(kind='Profile', indexed=False)
+
+class UserIdentity(ndb.Model):
+    """UserIdentity -- stable user id of an email for the custom user id mode, lowercased email as id"""
+    userId          = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -74,25 +102,102 @@ class Speaker(ndb.Model):
     name            = ndb.StringProperty(required=True)
     bio             = ndb.StringProperty()
 
+    # stats maintained as sessions are created
+    sessions        = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    conferences     = ndb.KeyProperty(kind='Conference', repeated=True, indexed=False)
+    nextSession     = ndb.KeyProperty(kind='Session', indexed=False)
+    nextSessionStart = ndb.DateTimeProperty(indexed=False)
+
 class SpeakerForm(messages.Message):
     """SpeakerForm -- Speaker outbound form message"""
     name            = messages.StringField(1)
     bio             = messages.StringField(2, default='')
+    sessionCount    = messages.IntegerField(3)
+    conferenceCount = messages.IntegerField(4)
+    websafeNextSessionKey = messages.StringField(5)
+    nextSessionStart = messages.StringField(6)
     websafeKey      = messages.StringField(8)
 
 class SpeakerForms(messages.Message):
     """SpeakerForms -- multiple Speaker outbound form message"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
 
+class FeaturedSpeakers(ndb.Model):
+    """FeaturedSpeakers -- session counts of the speakers of a conference & their top ranking, websafe conference key as id"""
+    counts          = ndb.PickleProperty()  # {websafe speaker key: sessions in the conference}
+    ranking         = ndb.PickleProperty()  # [(websafe speaker key, sessions)], most sessions first
+    sessions        = ndb.StringProperty(repeated=True, indexed=False)  # websafe keys of the sessions counted
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker with their number of sessions outbound form message"""
+    speaker = messages.MessageField(SpeakerForm, 1)
+    sessions = messages.IntegerField(2)
+
+class FeaturedSpeakerForms(messages.Message):
+    """FeaturedSpeakerForms -- ranked featured speakers of a conference outbound form message"""
+    items = messages.MessageField(FeaturedSpeakerForm, 1, repeated=True)
+
+class SpeakerPageForm(messages.Message):
+    """SpeakerPageForm -- one page of the speaker directory outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    page = messages.IntegerField(2)
+    pageCount = messages.IntegerField(3)
+
+class LegacyProperty(object):
+    """LegacyProperty -- mixin for properties of a legacy schema; without a value the property is not
+    written at all, rather than stored & indexed as null"""
+    def _serialize(self, entity, *args, **kwargs):
+        if self._get_value(entity) is not None:
+            super(LegacyProperty, self)._serialize(entity, *args, **kwargs)
+
+class LegacyStringProperty(LegacyProperty, ndb.StringProperty):
+    pass
+
+class LegacyDateProperty(LegacyProperty, ndb.DateProperty):
+    pass
+
+class LegacyTimeProperty(LegacyProperty, ndb.TimeProperty):
+    pass
+
 class Session(ndb.Model):
     """Session -- Session object"""
     name            = ndb.StringProperty(required=True)
     highlights      = ndb.StringProperty()
-    speakerKeys     = ndb.StringProperty(repeated=True)
+    speakers        = ndb.KeyProperty(kind='Speaker', repeated=True)
     duration        = ndb.IntegerProperty()  # in minutes
-    typeOfSession   = ndb.StringProperty()
-    date            = ndb.DateProperty(required=True)
-    startTime       = ndb.TimeProperty(required=True)
+    typeCode        = ndb.IntegerProperty()  # SessionTypes number
+    start           = ndb.DateTimeProperty()  # date & start time, sortable
+    startMinutes    = ndb.IntegerProperty()  # minutes since midnight
+
+    # legacy string schema, only read until the session migration has converted every entity;
+    # compact sessions leave them unset, so they are not stored or indexed
+    speakerKeys     = ndb.StringProperty(repeated=True)
+    typeOfSession   = LegacyStringProperty()
+    date            = LegacyDateProperty()
+    startTime       = LegacyTimeProperty()
+
+class SessionHourBucket(ndb.Model):
+    """SessionHourBucket -- keys of sessions of all conferences starting in one hour, id 'YYYYMMDDHH_shard'"""
+    sessions        = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+class SessionNeighbours(ndb.Model):
+    """SessionNeighbours -- recommended sessions for a session, best first; child of Session"""
+    neighbours      = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    scores          = ndb.FloatProperty(repeated=True, indexed=False)
+
+class SessionCooccurrence(ndb.Model):
+    """SessionCooccurrence -- sessions most often wishlisted together with a session in a recommendation run, child of Session"""
+    targets         = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    counts          = ndb.IntegerProperty(repeated=True, indexed=False)
+    run             = ndb.IntegerProperty(indexed=False)  # RecommendationState.run the counts belong to
+    seq             = ndb.IntegerProperty(indexed=False)  # counting tasks of the run merged so far
+
+class RecommendationState(ndb.Model):
+    """RecommendationState -- checkpoint of the wishlist scan of the current recommendation run, a singleton with id 1"""
+    run             = ndb.IntegerProperty(indexed=False)  # start time of the run in seconds
+    seq             = ndb.IntegerProperty(default=0, indexed=False)  # number of the counting task that owns the scan
+    cursor          = ndb.StringProperty(indexed=False)  # Profile query cursor the counts run up to
+    counted         = ndb.BooleanProperty(default=False, indexed=False)  # every profile is counted
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -129,10 +234,11 @@ class Conference(ndb.Model):
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
-    month           = ndb.IntegerProperty() # TODO: do we need for indexing like Java?
+    month           = ndb.IntegerProperty() # equality filter only; date ranges use the calendar index
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatsParked     = ndb.IntegerProperty(default=0, indexed=False)  # of seatsAvailable, moved into seat shards
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -171,6 +277,125 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class ConferenceFacetShard(ndb.Model):
+    """ConferenceFacetShard -- one shard of the (city, topics, month) conference counters"""
+    counts          = ndb.PickleProperty(compressed=True)  # {(city, sorted topics tuple, month): count}
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of conferences having one facet value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- per-city, per-topic and per-month conference counts outbound form message"""
+    cities = messages.MessageField(FacetCountForm, 1, repeated=True)
+    topics = messages.MessageField(FacetCountForm, 2, repeated=True)
+    months = messages.MessageField(FacetCountForm, 3, repeated=True)
+
+class ExportJob(ndb.Model):
+    """ExportJob -- nightly export run with its resumable checkpoint"""
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    kindIndex       = ndb.IntegerProperty(default=0)  # index into the exported kinds
+    cursor          = ndb.StringProperty(indexed=False)  # websafe cursor within the current kind
+    chunks          = ndb.IntegerProperty(default=0)
+    rows            = ndb.IntegerProperty(default=0)
+    done            = ndb.BooleanProperty(default=False)
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- newline-delimited JSON rows of one export batch, child of ExportJob"""
+    kind            = ndb.StringProperty()
+    rows            = ndb.IntegerProperty()
+    data            = ndb.BlobProperty(compressed=True)
+
+class WaitlistShard(ndb.Model):
+    """WaitlistShard -- one shard of the FIFO waitlist of a conference"""
+    entries         = ndb.PickleProperty()  # [(joined timestamp, user id), ...] oldest first
+
+class SeatShard(ndb.Model):
+    """SeatShard -- block of a conference's seats parked for holds so that they do not contend on the conference"""
+    seats           = ndb.IntegerProperty(default=0)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class SeatHold(ndb.Model):
+    """SeatHold -- seat held for a user until confirmed or expired, child of SeatShard with the user id as id"""
+    userId          = ndb.StringProperty(indexed=False)
+    conferenceKey   = ndb.StringProperty(indexed=False)
+    expires         = ndb.DateTimeProperty()
+
+class SeatHoldForm(messages.Message):
+    """SeatHoldForm -- SeatHold outbound form message"""
+    websafeKey = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    expires = messages.StringField(3)
+
+class GroupReservation(ndb.Model):
+    """GroupReservation -- seats reserved for a group registration until its attendees are registered, child of Conference"""
+    attendees       = ndb.StringProperty(repeated=True, indexed=False)  # user ids the seats were reserved for
+
+class GroupRegistrationForm(messages.Message):
+    """GroupRegistrationForm -- group registration inbound form message"""
+    attendees = messages.StringField(1, repeated=True)  # user ids of the attendees
+
+class AttendeeRegistrationForm(messages.Message):
+    """AttendeeRegistrationForm -- registration result of one attendee"""
+    attendee = messages.StringField(1)
+    status = messages.EnumField('RegistrationStatus', 2)
+
+class AttendeeRegistrationForms(messages.Message):
+    """AttendeeRegistrationForms -- multiple AttendeeRegistrationForm outbound form message"""
+    items = messages.MessageField(AttendeeRegistrationForm, 1, repeated=True)
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- registration result enumeration value"""
+    REGISTERED = 1
+    ALREADY_REGISTERED = 2
+    NO_PROFILE = 3
+    FAILED = 4
+
+class MapperJob(ndb.Model):
+    """MapperJob -- run of a mapper job over the key ranges of one kind"""
+    name            = ndb.StringProperty()
+    shards          = ndb.IntegerProperty()
+    shardsDone      = ndb.IntegerProperty(default=0)
+    started         = ndb.DateTimeProperty(auto_now_add=True)
+    finished        = ndb.DateTimeProperty()
+    results         = ndb.PickleProperty()  # whatever the job's finish function reports
+    finishCursor    = ndb.StringProperty(indexed=False)  # page the finish function is at, while it pages
+
+class MapperShard(ndb.Model):
+    """MapperShard -- key range of a MapperJob with its checkpoint, child of MapperJob with its index as id"""
+    start           = ndb.KeyProperty(indexed=False)  # inclusive, None from the first key of the kind
+    end             = ndb.KeyProperty(indexed=False)  # exclusive, None up to the last key of the kind
+    cursor          = ndb.StringProperty(indexed=False)
+    seq             = ndb.IntegerProperty(default=0, indexed=False)  # number of the task that owns the shard
+    processed       = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class MapperCounter(ndb.Model):
+    """MapperCounter -- count aggregated by the map function of a MapperJob, child of the job with its name as id"""
+    count           = ndb.IntegerProperty(default=0, indexed=False)
+
+class ChangeLogEntry(ndb.Model):
+    """ChangeLogEntry -- one change to a conference or session, a root entity with an allocated id"""
+    kind            = ndb.StringProperty(indexed=False)
+    websafeKey      = ndb.StringProperty(indexed=False)
+    operation       = ndb.StringProperty(indexed=False)  # create, update, delete, register or unregister
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class ChangeForm(messages.Message):
+    """ChangeForm -- ChangeLogEntry outbound form message"""
+    kind = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    operation = messages.StringField(3)
+    created = messages.StringField(4)
+
+class ChangeForms(messages.Message):
+    """ChangeForms -- batch of changes with the cursor to continue from outbound form message"""
+    items = messages.MessageField(ChangeForm, 1, repeated=True)
+    cursor = messages.StringField(2)
+    resync = messages.BooleanField(3, default=False)  # cursor expired, reload everything then continue
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -16,3 +16,34 @@ WEB_CLIENT_ID = 'replace with Web client ID'
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Buffer saveProfile() edits in memcache and write them in one put per
+# PROFILE_WRITE_BEHIND_DELAY seconds instead of on every request. Every edit
+# also rides along with its flush task, so an eviction does not lose it.
+PROFILE_WRITE_BEHIND = False
+PROFILE_WRITE_BEHIND_DELAY = 5
+
+# Coalescing of hot read endpoints: a cached response is fresh for 'ttl'
+# seconds and may be served stale for 'stale' more while one request holds
+# a 'lease' second lease to recompute it; without a stale copy the other
+# requests wait up to 'wait' seconds.
+COALESCE_SETTINGS = {
+    'getConference': {'ttl': 5, 'stale': 30, 'lease': 5, 'wait': 1.0},
+    'getConferenceSessions': {'ttl': 10, 'stale': 60, 'lease': 5, 'wait': 1.0},
+}
+
+# Per-user token buckets in front of expensive query endpoints:
+# (bucket capacity, tokens refilled per second). Callers over their limit
+# get a 503, as Endpoints v1 cannot return a 429.
+RATE_LIMITS = {
+    'queryConferences': (20, 1.0),
+    'getSessionsBySpeaker': (20, 1.0),
+}
+
+# Also query the legacy string fields of Session entities; switch off once
+# the session migration (/crons/migrate_sessions) has run to completion.
+SESSION_LEGACY_READS = True
+
+# Prime caches on /_ah/warmup before an instance takes traffic; switch off
+# to compare cold-start latency without it.
+WARMUP_ENABLED = True
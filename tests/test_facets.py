@@ -0,0 +1,49 @@
+"""Facet counts keep being served when their counters outgrow the memcache value limit.
+
+Needs the App Engine SDK on the path; run from the repository root with
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from conference import MEMCACHE_FACETS_KEY
+from models import ConferenceFacetShard
+from models import ConferenceQueryForms
+
+CELLS = 40000
+
+
+class LargeFacetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        # every conference in a city and topic combination of its own
+        counts = dict((('City %05d' % i, ('Topic %05d' % i, 'Topic %05d' % (i + 1)), i % 12 + 1), 1)
+                      for i in range(CELLS))
+        ConferenceFacetShard(id=1, counts=counts).put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testLargeFacetsServedUncached(self):
+        facets = ConferenceApi().getConferenceFacets(ConferenceQueryForms())
+        self.assertEqual(len(facets.cities), CELLS)
+        self.assertEqual(sum(month.count for month in facets.months), CELLS)
+        self.assertIsNone(memcache.get(MEMCACHE_FACETS_KEY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Multi-threaded benchmark of the lock overhead of LocalCache, with one lock against striped locks
+and against an unlocked dict lookup. Prints its measurements with -v.
+
+Needs the App Engine SDK on the path; run from the repository root with
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.ext import testbed
+
+from utils import LocalCache
+
+KEYS = 1000
+LOOKUPS = 20000  # per thread
+THREADS = (1, 4, 16)
+
+
+def runThreads(threads, work):
+    """Run work() in the given number of threads at once; return the seconds until all finished."""
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - started
+
+
+class LocalCacheBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _measure(self, threads, stripes):
+        """Return microseconds per cached lookup, checking every lookup was a hit with the right value."""
+        cache = LocalCache('Benchmark%d' % stripes, size=KEYS * 2, ttl=60 * 60, stripes=stripes, check=60)
+        for key in range(KEYS):
+            cache.get(key, lambda k: k * 2)
+        errors = []
+
+        def work():
+            for i in xrange(LOOKUPS):
+                key = i % KEYS
+                if cache.get(key, lambda k: None) != key * 2:
+                    errors.append(key)
+
+        seconds = runThreads(threads, work)
+        self.assertEqual(errors, [])
+        self.assertEqual(cache.stats()['hits'], threads * LOOKUPS)
+        return seconds * 1e6 / (threads * LOOKUPS)
+
+    def testLockOverhead(self):
+        values = dict((key, key * 2) for key in range(KEYS))
+
+        for threads in THREADS:
+            def work():
+                for i in xrange(LOOKUPS):
+                    values.get(i % KEYS)
+            baseline = runThreads(threads, work) * 1e6 / (threads * LOOKUPS)
+            oneLock = self._measure(threads, stripes=1)
+            striped = self._measure(threads, stripes=16)
+            sys.stderr.write('\n%2d threads: dict %.2fus  1 lock %.2fus  16 stripes %.2fus per lookup'
+                             % (threads, baseline, oneLock, striped))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Stress test of seat holds: concurrent holds never sell more seats than a conference has.
+
+Needs the App Engine SDK on the path; run from the repository root with
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import endpoints
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+from conference import CONF_GET_REQUEST
+from conference import SEAT_HOLD_REQUEST
+from conference import ConferenceApi
+from models import ConflictException
+from models import Conference
+from models import Profile
+from models import SeatHold
+from models import SeatShard
+
+SEATS = 25
+USERS = 60
+
+
+class SeatHoldStressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        # each thread acts as its own signed in user
+        self.local = threading.local()
+        self.getCurrentUser = endpoints.get_current_user
+        conference.endpoints.get_current_user = lambda: getattr(self.local, 'user', None)
+
+        self.confKey = Conference(name='Stress', organizerUserId='organizer@example.com',
+                                  maxAttendees=SEATS, seatsAvailable=SEATS).put()
+        self.request = CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=self.confKey.urlsafe())
+
+    def tearDown(self):
+        conference.endpoints.get_current_user = self.getCurrentUser
+        self.testbed.deactivate()
+
+    def _hold(self, email, results):
+        self.local.user = users.User(email)
+        try:
+            ConferenceApi().holdSeat(self.request)
+            results.append(email)
+        except endpoints.ServiceException:
+            # sold out (409), or contended and told to retry (503): failed holds, not sold seats
+            pass
+
+    def _seatsLeft(self):
+        conf = self.confKey.get()
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(self.confKey.urlsafe()))
+        return ConferenceApi._unparkedSeats(conf) + sum(shard.seats for shard in shards if shard)
+
+    def testConcurrentHoldsDoNotOversell(self):
+        results = []
+        threads = [threading.Thread(target=self._hold, args=('user%d@example.com' % i, results))
+                   for i in range(USERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        holds = SeatHold.query().fetch()
+        self.assertEqual(len(holds), len(results))
+        self.assertTrue(len(holds) <= SEATS)
+        self.assertEqual(len(set(hold.userId for hold in holds)), len(holds))
+        # every seat is either still available, parked in a shard, or held
+        self.assertEqual(self._seatsLeft() + len(holds), SEATS)
+
+    def testSecondHoldReturnsTheFirst(self):
+        self.local.user = users.User('user@example.com')
+        first = ConferenceApi().holdSeat(self.request)
+        second = ConferenceApi().holdSeat(self.request)
+        self.assertEqual(first.websafeKey, second.websafeKey)
+        self.assertEqual(SeatHold.query().count(), 1)
+        self.assertEqual(self._seatsLeft(), SEATS - 1)
+
+    def testHeldConferenceStillReportsItsSeats(self):
+        self.local.user = users.User('user@example.com')
+        ConferenceApi().holdSeat(self.request)
+        # parking the seats for holds does not make the conference look sold out
+        self.assertEqual(ConferenceApi().getConference(self.request).seatsAvailable, SEATS)
+        self.assertEqual(self.confKey.get().seatsAvailable, SEATS)
+
+        ConferenceApi().confirmSeatHold(SEAT_HOLD_REQUEST.combined_message_class(
+            websafeHoldKey=SeatHold.query().get(keys_only=True).urlsafe()))
+        self.assertEqual(self.confKey.get().seatsAvailable, SEATS - 1)
+        self.assertEqual(self._seatsLeft(), SEATS - 1)
+
+    def testRegisteredUserCannotHold(self):
+        Profile(id='user@example.com', mainEmail='user@example.com', conferencesToAttend=[self.confKey]).put()
+        self.local.user = users.User('user@example.com')
+        self.assertRaises(ConflictException, ConferenceApi().holdSeat, self.request)
+        self.assertEqual(self._seatsLeft(), SEATS)
+
+    def testRegistrationUsesShardSeats(self):
+        # park every seat in a shard, as holdSeat does, then register without a hold
+        wsck = self.confKey.urlsafe()
+        shardKey = ConferenceApi._seatShardKeys(wsck)[0]
+        conf = self.confKey.get()
+        conf.seatsParked = SEATS
+        ndb.put_multi([conf, SeatShard(key=shardKey, seats=SEATS)])
+
+        self.local.user = users.User('user@example.com')
+        self.assertTrue(ConferenceApi().registerForConference(self.request).data)
+        self.assertEqual(shardKey.get().seats, SEATS - 1)
+        conf = self.confKey.get()
+        self.assertEqual((conf.seatsAvailable, conf.seatsParked), (SEATS - 1, SEATS - 1))
+        self.assertRaises(ConflictException, ConferenceApi().joinWaitlist, self.request)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Benchmark of the compact Session schema against the legacy string schema: entity bytes,
+built-in index bytes and serialization time. Prints its measurements with -v.
+
+Needs the App Engine SDK on the path; run from the repository root with
+    python -m unittest discover tests
+"""
+import os
+import sys
+import timeit
+import unittest
+from datetime import date
+from datetime import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from models import Session
+from models import Speaker
+
+ROUNDS = 2000
+
+
+def entityBytes(entity):
+    """Return the size of an entity as stored."""
+    return len(entity._to_pb().Encode())
+
+
+def indexBytes(entity):
+    """Estimate the size of the built-in index rows of an entity: an ascending and a descending
+    row per indexed property value, each holding the kind, the value and the entity key."""
+    pb = entity._to_pb()
+    keyBytes = len(pb.key().Encode())
+    kindBytes = len(entity._get_kind())
+    return sum(2 * (kindBytes + len(prop.Encode()) + keyBytes) for prop in pb.property_list())
+
+
+class SessionSchemaBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+
+        confKey = Conference(name='Benchmark').put()
+        speakerKeys = [Speaker(name='Speaker %d' % i).put() for i in range(3)]
+        self.legacy = Session(
+            parent=confKey,
+            id=1,
+            name='Scaling the datastore',
+            highlights='Sharding, batching and caching',
+            speakerKeys=[speakerKey.urlsafe() for speakerKey in speakerKeys],
+            duration=45,
+            typeOfSession='WORKSHOP',
+            date=date(2016, 5, 3),
+            startTime=time(14, 30),
+        )
+        self.compact = Session(parent=confKey, id=1, **self.legacy.to_dict())
+        ConferenceApi._upgradeSession(self.compact)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _report(self, name, legacy, compact):
+        sys.stderr.write('\n%-22s legacy %8.1f  compact %8.1f' % (name, legacy, compact))
+
+    def testEntityBytes(self):
+        legacy, compact = entityBytes(self.legacy), entityBytes(self.compact)
+        self._report('entity bytes', legacy, compact)
+        self.assertTrue(compact < legacy)
+
+    def testIndexBytes(self):
+        legacy, compact = indexBytes(self.legacy), indexBytes(self.compact)
+        self._report('index bytes', legacy, compact)
+        self.assertTrue(compact < legacy)
+
+    def testLegacyPropertiesNotWritten(self):
+        names = set(prop.name() for prop in self.compact._to_pb().property_list())
+        self.assertFalse(names & set(['speakerKeys', 'typeOfSession', 'date', 'startTime']))
+
+    def testMigrationSkipsDeletedSessions(self):
+        # listed by a migration batch, then deleted before it was converted
+        self.assertFalse(ConferenceApi._migrateSession(self.legacy.key))
+        self.assertIsNone(self.legacy.key.get())
+
+        self.legacy.put()
+        self.assertTrue(ConferenceApi._migrateSession(self.legacy.key))
+        self.assertIsNotNone(self.legacy.key.get().startMinutes)
+
+    def testSerializationTime(self):
+        timings = []
+        for entity in (self.legacy, self.compact):
+            encoded = entity._to_pb().Encode()
+            encode = timeit.timeit(lambda: entity._to_pb().Encode(), number=ROUNDS)
+            decode = timeit.timeit(lambda: Session._from_pb(entity_pb.EntityProto(encoded)), number=ROUNDS)
+            timings.append((encode, decode))
+        self._report('encode us/entity', timings[0][0] * 1e6 / ROUNDS, timings[1][0] * 1e6 / ROUNDS)
+        self._report('decode us/entity', timings[0][1] * 1e6 / ROUNDS, timings[1][1] * 1e6 / ROUNDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests that buffered side-effect tasks are enqueued exactly once with the write that produced them,
+and not at all when that write rolls back.
+
+Needs the App Engine SDK on the path; run from the repository root with
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from utils import TaskBuffer
+
+
+class TaskBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _buffer(self):
+        tasks = TaskBuffer()
+        tasks.add(params={'n': '1'}, url='/tasks/one')
+        tasks.add(params={'n': '2'}, url='/tasks/two')
+        return tasks
+
+    def _queued(self):
+        return sorted(task.url for task in self.taskqueue.get_filtered_tasks())
+
+    def testCommitEnqueuesOnce(self):
+        tasks = self._buffer()
+        ndb.transaction(lambda: ConferenceApi._putWithTasks([Conference(name='Commit')], tasks))
+        self.assertEqual(self._queued(), ['/tasks/one', '/tasks/two'])
+
+    def testRollbackEnqueuesNothing(self):
+        tasks = self._buffer()
+
+        def txn():
+            ConferenceApi._putWithTasks([Conference(name='Rollback')], tasks)
+            raise ndb.Rollback()
+        ndb.transaction(txn)
+        self.assertEqual(self._queued(), [])
+        self.assertEqual(Conference.query().count(), 0)
+
+    def testRetryAfterRollbackEnqueuesOnce(self):
+        # the same buffer is flushed by a rolled back attempt and then by the attempt that commits
+        tasks = self._buffer()
+        attempts = []
+
+        def txn():
+            attempts.append(1)
+            ConferenceApi._putWithTasks([Conference(name='Retry')], tasks)
+            if len(attempts) == 1:
+                raise ndb.Rollback()
+        ndb.transaction(txn)
+        ndb.transaction(txn)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self._queued(), ['/tasks/one', '/tasks/two'])
+        self.assertEqual(Conference.query().count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
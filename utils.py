@@ -1,10 +1,19 @@
+import collections
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
+from models import UserIdentity
+
+MEMCACHE_CAS_RETRIES = 5
+MEMCACHE_USER_ID_KEY = 'USER_ID_%s'
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -35,11 +44,220 @@ def getUserId(user, id_type="email"):
         return user.get('user_id', '')
 
     if id_type == "custom":
-        # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        # stable id minted the first time an email is seen, see resolveUserId()
+        return resolveUserId(user.email())
+
+
+def resolveUserId(email):
+    """Return the user id mapped to an email, minting and storing one the
+    first time the email is seen.
+
+    Mappings never change once created, so they are cached in process and
+    in memcache and a resolved id costs no datastore RPC.
+    """
+    return USER_ID_CACHE.get(email.lower(), _loadUserId)
+
+
+def _loadUserId(email):
+    user_id = memcache.get(MEMCACHE_USER_ID_KEY % email)
+    if user_id is None:
+        user_id = claimUserId(email, uuid.uuid4().hex)
+        memcache.set(MEMCACHE_USER_ID_KEY % email, user_id)
+    return user_id
+
+
+@ndb.transactional()
+def claimUserId(email, user_id):
+    """Map email to user_id unless it is mapped already; return the user id
+    the email is mapped to."""
+    key = ndb.Key(UserIdentity, email.lower())
+    identity = key.get()
+    if not identity:
+        identity = UserIdentity(key=key, userId=user_id)
+        identity.put()
+    return identity.userId
+
+
+def getCoalesced(key, compute, ttl, stale, lease, wait, poll=0.05):
+    """Return the value cached under key, letting only one request at a time
+    recompute it with compute().
+
+    A value is fresh for ttl seconds and kept for another stale seconds. The
+    request that wins the memcache add() lease recomputes it; the others are
+    served the stale value, or wait up to wait seconds for the new one.
+    """
+    now = time.time()
+    cached = memcache.get(key)  # (fresh until, value)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    leaseKey = '%s_lease' % key
+    if memcache.add(leaseKey, 1, time=lease):
+        try:
+            value = compute()
+            memcache.set(key, (time.time() + ttl, value), time=ttl + stale)
+            return value
+        finally:
+            memcache.delete(leaseKey)
+
+    # somebody else is recomputing; serve stale or wait briefly for the result
+    if cached:
+        return cached[1]
+    deadline = now + wait
+    while time.time() < deadline:
+        time.sleep(poll)
+        cached = memcache.get(key)
+        if cached:
+            return cached[1]
+    return compute()
+
+
+def setCoalesced(values, ttl, stale, **kwargs):
+    """Cache values ({key: value}) the way getCoalesced() does, as if each
+    had just been recomputed; takes the same settings as getCoalesced().
+    """
+    fresh_until = time.time() + ttl
+    memcache.set_multi(dict((key, (fresh_until, value)) for key, value in values.items()),
+                       time=ttl + stale)
+
+
+def takeToken(key, capacity, rate):
+    """Take a token from the memcache token bucket under key, refilled at rate
+    tokens per second up to capacity. Return False if the bucket is empty.
+    Fails open if memcache is too contended to update the bucket.
+    """
+    client = memcache.Client()
+    expiry = int(capacity / rate) + 1
+    for i in range(MEMCACHE_CAS_RETRIES):
+        now = time.time()
+        bucket = client.gets(key)  # (tokens, last update)
+        if bucket is None:
+            if client.add(key, (capacity - 1, now), time=expiry):
+                return True
+            continue
+        tokens, stamp = bucket
+        tokens = min(capacity, tokens + (now - stamp) * rate)
+        if tokens < 1:
+            return False
+        if client.cas(key, (tokens - 1, now), time=expiry):
+            return True
+    return True
+
+
+class TaskBuffer(object):
+    """Collects the side-effect tasks of a request so they can be enqueued
+    with a single batched Queue.add RPC.
+
+    Flushing transactionally inside the transaction that makes the datastore
+    write means the tasks are only enqueued if that write commits (at most
+    5 tasks per transaction). Tasks are only built when flushed, so a
+    transaction that is retried can flush the same buffer again.
+    """
+
+    def __init__(self, queue_name='default'):
+        self.queue_name = queue_name
+        self.tasks = []
+
+    def add(self, **kwargs):
+        """Buffer a task; takes the same arguments as taskqueue.Task."""
+        self.tasks.append(kwargs)
+
+    def flush_async(self, transactional=False):
+        """Start enqueueing all buffered tasks in one batch and return the
+        RPC, or None if there is nothing to enqueue."""
+        if not self.tasks:
+            return None
+        tasks = [taskqueue.Task(**kwargs) for kwargs in self.tasks]
+        return taskqueue.Queue(self.queue_name).add_async(tasks, transactional=transactional)
+
+    def flush(self, transactional=False):
+        """Enqueue all buffered tasks in one batch and wait for the result."""
+        rpc = self.flush_async(transactional=transactional)
+        if rpc:
+            rpc.get_result()
+
+
+class LocalCache(object):
+    """Bounded in-process LRU cache shared by the request threads of an
+    instance, for entities that rarely change.
+
+    Keys are spread over stripes that each have their own lock and LRU
+    order, so threads looking up different keys rarely wait on each other.
+    Entries expire after ttl seconds. invalidate() bumps a version number in
+    memcache; every instance polls it at most once per check seconds and
+    drops all its entries when it moved. Values are shared between threads
+    and must not be modified.
+    """
+
+    def __init__(self, name, size, ttl, stripes=16, check=1.0):
+        self.version_key = 'LOCAL_CACHE_VERSION_%s' % name
+        self.ttl = ttl
+        self.check = check
+        self.stripe_size = max(1, size // stripes)
+        self.stripes = [(threading.Lock(), collections.OrderedDict(), [0, 0])
+                        for i in range(stripes)]
+        self.version_lock = threading.Lock()
+        self.version = None
+        self.checked = 0
+
+    def _stripe(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def _check_version(self):
+        """Drop all entries if another instance invalidated one since the last check."""
+        if time.time() < self.checked + self.check:
+            return
+        with self.version_lock:
+            if time.time() < self.checked + self.check:
+                return
+            version = memcache.get(self.version_key)
+            if version != self.version:
+                for lock, entries, counts in self.stripes:
+                    with lock:
+                        entries.clear()
+                self.version = version
+            self.checked = time.time()
+
+    def get(self, key, load):
+        """Return the value cached under key, or load(key) if there is none.
+        A None value is returned but not cached."""
+        self._check_version()
+        lock, entries, counts = self._stripe(key)
+        with lock:
+            entry = entries.pop(key, None)  # (expires, value)
+            if entry and entry[0] > time.time():
+                entries[key] = entry  # most recently used last
+                counts[0] += 1
+                return entry[1]
+            counts[1] += 1
+            version = self.version
+
+        value = load(key)
+        if value is not None:
+            with lock:
+                # skip the value if the cache was dropped while it loaded
+                if version == self.version:
+                    entries[key] = (time.time() + self.ttl, value)
+                    while len(entries) > self.stripe_size:
+                        entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        """Drop key here and make all instances drop their entries."""
+        lock, entries, counts = self._stripe(key)
+        with lock:
+            entries.pop(key, None)
+        memcache.incr(self.version_key, initial_value=0)
+
+    def stats(self):
+        """Return the number of entries, hits and misses of this instance."""
+        size = hits = misses = 0
+        for lock, entries, counts in self.stripes:
+            with lock:
+                size += len(entries)
+                hits += counts[0]
+                misses += counts[1]
+        return {'size': size, 'hits': hits, 'misses': misses}
+
+
+USER_ID_CACHE = LocalCache('UserIdentity', size=5000, ttl=60 * 60)